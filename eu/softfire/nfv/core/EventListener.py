@@ -0,0 +1,62 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+from eu.softfire.nfv.utils.utils import get_logger
+
+logger = get_logger(__name__)
+
+# the Open Baton actions the NFV Manager subscribes to
+NSR_EVENT_ACTIONS = ['INSTANTIATE_FINISH', 'ERROR', 'SCALED', 'HEAL']
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _EventRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            event = json.loads(self.rfile.read(length).decode('utf-8'))
+            assert isinstance(event, dict)
+        except:
+            logger.warning('Received an event that is not a JSON object')
+            self.send_response(400)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        try:
+            self.server.event_handler(event)
+        except Exception as e:
+            logger.error("got error while handling event %s: %s" % (event.get('action'), e))
+
+    def log_message(self, format, *args):
+        logger.debug("Event listener: %s" % (format % args))
+
+
+class EventListener(Thread):
+    def __init__(self, event_handler, port, host='localhost'):
+        """
+        Small HTTP server receiving the events sent by Open Baton to the REST event endpoints. The events are not
+        authenticated, the handler must use them only as a trigger.
+
+        :param event_handler: function called with every event received (as dict)
+        :param port: the port to listen on, 0 chooses a free one
+        :param host: the address to listen on
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.server = _ThreadingHTTPServer((host, int(port)), _EventRequestHandler)
+        self.server.event_handler = event_handler
+        self.port = self.server.server_address[1]
+
+    def run(self):
+        logger.info("Listening for Open Baton events on %s:%s" % (self.server.server_address[0], self.port))
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
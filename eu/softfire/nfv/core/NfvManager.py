@@ -1,30 +1,36 @@
+import hashlib
 import json
 # from utils import os_utils_opnfv
 import os
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from os import listdir
 from os.path import isfile, join
-from threading import Thread
+from threading import Thread, BoundedSemaphore, Event, RLock
 
 import sys
+import grpc
 import yaml
 from org.openbaton.cli.errors.errors import NfvoException
 from org.openbaton.cli.openbaton import LIST_PRINT_KEY
-from sdk.softfire.grpc import messages_pb2
+from sdk.softfire.grpc import messages_pb2, messages_pb2_grpc
 from sdk.softfire.manager import AbstractManager
 from sdk.softfire.utils import TESTBED_MAPPING
 from sqlalchemy.orm.exc import NoResultFound
 
-from eu.softfire.nfv.db.entities import Nsr
-from eu.softfire.nfv.db.repositories import find, delete, save
+from eu.softfire.nfv.core.EventListener import NSR_EVENT_ACTIONS
+from eu.softfire.nfv.core.StatusScheduler import StatusScheduler
+from eu.softfire.nfv.db.entities import Nsr, ReleaseJob
+from eu.softfire.nfv.db.repositories import find, delete, upsert, upsert_all, iter_nsrs
 from eu.softfire.nfv.utils import os_utils
+from eu.softfire.nfv.utils.csar_utils import inspect_csar, validate_testbeds
 from eu.softfire.nfv.utils.exceptions import NfvResourceValidationError, NfvResourceDeleteException, \
     MissingFileException, NfvManagerNotFoundException
-from eu.softfire.nfv.utils.ob_utils import OBClient
+from eu.softfire.nfv.utils.ob_utils import OBClient, get_ob_client, invalidate_ob_client
 from eu.softfire.nfv.utils.os_utils import create_os_project
-from eu.softfire.nfv.utils.static_config import CONFIG_FILE_PATH
-from eu.softfire.nfv.utils.utils import get_available_nsds, get_logger, get_config
+from eu.softfire.nfv.utils.utils import get_logger, get_config_value, get_config_int, get_config_float, \
+    get_config_bool, get_nsd_catalogue
 
 logger = get_logger(__name__)
 
@@ -43,7 +49,11 @@ class UpdateStatusThread(Thread):
 
     def run(self):
         while not self.stopped:
-            time.sleep(int(self.nfv_manager.get_config_value('system', 'update-delay', '10')))
+            if self.nfv_manager.events_enabled():
+                # the events deliver the status changes, polling only reconciles the missed ones
+                time.sleep(self.nfv_manager.get_config_int('system', 'event-reconciliation-delay', 300))
+            else:
+                time.sleep(self.nfv_manager.get_config_int('system', 'update-delay', 10))
             if not self.stopped:
                 try:
                     self.nfv_manager.send_update()
@@ -58,43 +68,219 @@ class UpdateStatusThread(Thread):
         self.stopped = True
 
 
+RELEASE_DELETING = 'DELETING'
+RELEASE_DONE = 'DONE'
+RELEASE_FAILED = 'FAILED'
+
+
+class ReleaseReaper(Thread):
+    def __init__(self, timeout=1000, initial_delay=5, max_delay=30, keep_finished=3600, on_untracked=None):
+        """
+        Background thread completing the release of the NSRs whose deletion was requested: it polls Open Baton, with
+        an increasing delay, until the NSR is removed, then deletes the NSD and stops tracking the NSR. The pending
+        jobs are stored in the database and resumed after a restart.
+
+        :param timeout: seconds after which the NSR is considered not removable
+        :param initial_delay: seconds before the first check
+        :param max_delay: maximum seconds between two checks of the same NSR
+        :param keep_finished: seconds the finished jobs can still be queried
+        :param on_untracked: function called with the id of an NSR that is not tracked anymore
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.stopped = False
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.keep_finished = keep_finished
+        self.on_untracked = on_untracked
+        # {nsr_id: job}
+        self._jobs = {}
+        self._lock = RLock()
+        self._wakeup = Event()
+
+    def submit(self, username, nsr_id, nsd_id):
+        now = time.time()
+        upsert(ReleaseJob, {'id': nsr_id, 'username': username, 'nsd_id': nsd_id, 'submitted': now})
+        self._add_job(username, nsr_id, nsd_id, now)
+
+    def resume(self):
+        """
+        Load the jobs that were still pending when the NFV Manager stopped. Their timeout counts from the original
+        release request.
+        """
+        release_jobs = find(ReleaseJob)
+        if release_jobs:
+            logger.info("Resuming the release of %d NSRs" % len(release_jobs))
+        for release_job in release_jobs:
+            self._add_job(release_job.username, release_job.id, release_job.nsd_id, release_job.submitted)
+
+    def _add_job(self, username, nsr_id, nsd_id, submitted):
+        with self._lock:
+            self._jobs[nsr_id] = {
+                'nsr_id': nsr_id,
+                'nsd_id': nsd_id,
+                'username': username,
+                'status': RELEASE_DELETING,
+                'error': None,
+                'submitted': submitted,
+                'finished': None,
+                'delay': self.initial_delay,
+                'next_check': time.time() + self.initial_delay,
+            }
+        self._wakeup.set()
+
+    def get_job(self, nsr_id):
+        """
+        Return a copy of the release job of the NSR, None if there is none.
+        """
+        with self._lock:
+            job = self._jobs.get(nsr_id)
+            if job:
+                return dict(job)
+
+    def is_releasing(self, nsr_id):
+        job = self.get_job(nsr_id)
+        return job is not None and job.get('status') == RELEASE_DELETING
+
+    def run(self):
+        while not self.stopped:
+            self._wakeup.wait(self._seconds_to_next_check())
+            self._wakeup.clear()
+            if self.stopped:
+                break
+            for job in self._due_jobs():
+                try:
+                    self._check(job)
+                except Exception as e:
+                    traceback.print_exc()
+                    logger.error("got error while checking the release of NSR %s: %s" % (job.get('nsr_id'), e))
+                    self._reschedule(job)
+            self._forget_finished()
+
+    def stop(self):
+        self.stopped = True
+        self._wakeup.set()
+
+    def _seconds_to_next_check(self):
+        with self._lock:
+            next_checks = [job.get('next_check') for job in self._jobs.values() if
+                           job.get('status') == RELEASE_DELETING]
+        if not next_checks:
+            return self.max_delay
+        return max(min(next_checks) - time.time(), 0)
+
+    def _due_jobs(self):
+        now = time.time()
+        with self._lock:
+            return [job for job in self._jobs.values() if
+                    job.get('status') == RELEASE_DELETING and job.get('next_check') <= now]
+
+    def _reschedule(self, job):
+        with self._lock:
+            job['delay'] = min(job.get('delay') * 2, self.max_delay)
+            job['next_check'] = time.time() + job.get('delay')
+
+    def _finish(self, job, status, error=None):
+        remove_nsr_to_check(job.get('nsr_id'))
+        try:
+            delete(find(ReleaseJob, _id=job.get('nsr_id')))
+        except NoResultFound:
+            pass
+        if self.on_untracked:
+            self.on_untracked(job.get('nsr_id'))
+        with self._lock:
+            job['status'] = status
+            job['error'] = error
+            job['finished'] = time.time()
+
+    def _check(self, job):
+        ob_client = get_ob_client(job.get('username'))
+        try:
+            ob_client.get_nsr(job.get('nsr_id'))
+        except NfvoException:
+            try:
+                try_delete_nsd(job.get('nsd_id'), ob_client)
+            except NfvResourceDeleteException as e:
+                logger.error("...ignoring... %s" % e.message)
+                self._finish(job, RELEASE_FAILED, e.message)
+                return
+            logger.info("Removed NSR %s of user %s" % (job.get('nsr_id'), job.get('username')))
+            self._finish(job, RELEASE_DONE)
+            return
+        if time.time() - job.get('submitted') > self.timeout:
+            logger.error('Not able to delete NSR with id: %s ...ignoring...' % job.get('nsr_id'))
+            self._finish(job, RELEASE_FAILED, 'Not able to delete NSR with id: %s' % job.get('nsr_id'))
+            return
+        self._reschedule(job)
+
+    def _forget_finished(self):
+        now = time.time()
+        with self._lock:
+            for nsr_id in [nsr_id for nsr_id, job in self._jobs.items() if
+                           job.get('finished') and now - job.get('finished') > self.keep_finished]:
+                self._jobs.pop(nsr_id)
+
+
 def get_nsrs_to_check():
-    return find(Nsr)
+    return iter_nsrs(exclude_statuses=['ACTIVE'])
+
+
+def _nsr_values(username, nsr):
+    vnfc_hostnames = {}
+    for vnfr in nsr.get('vnfr') or []:
+        hostnames = [vnfc_instance.get('hostname') for vdu in vnfr.get('vdu') or [] for vnfc_instance in
+                     vdu.get('vnfc_instance') or []]
+        if hostnames:
+            vnfc_hostnames[vnfr.get('name')] = hostnames
+    return {
+        'id': nsr.get('id'),
+        'username': username,
+        'status': nsr.get('status'),
+        'vnfc_hostnames': vnfc_hostnames,
+        'last_checked': time.time(),
+    }
 
 
 def add_nsr_to_check(username, nsr):
+    upsert(Nsr, _nsr_values(username, nsr))
+
+
+def remove_nsr_to_check(nsr_id):
     try:
-        nsr_exists = find(Nsr, _id=nsr.get('id'))
-        if nsr_exists:
-            delete(nsr_exists)
+        delete(find(Nsr, _id=nsr_id))
     except NoResultFound:
         pass
 
-    nsr_to_save = Nsr()
-    nsr_to_save.username = username
-    nsr_to_save.id = nsr.get('id')
-    nsr_to_save.status = nsr.get('status')
-    nsr_to_save.vnf_log_url = {}
 
-    for vnfr in nsr.get('vnfr'):
-        for vdu in vnfr.get('vdu'):
-            for vnfc_instance in vdu.get('vnfc_instance'):
-                if not nsr_to_save.vnf_log_url.get(vnfr.get('name')):
-                    nsr_to_save.vnf_log_url[vnfr.get('name')] = ""
-                nsr_to_save.vnf_log_url[vnfr.get('name')] += "%s;" % vnfc_instance.get('hostname')
-    save(nsr_to_save, Nsr)
+_user_slots = {}
+_user_slots_lock = RLock()
 
 
-def remove_nsr_to_check(nsr_id):
+def _user_slot(username):
+    """
+    Return the semaphore capping the NSR status requests of the user in flight at the same time, from the polling, the
+    reconciliation and the events, to update-threads-per-user.
+    """
+    limit = get_config_int('system', 'update-threads-per-user', 2)
+    with _user_slots_lock:
+        slot = _user_slots.get(username)
+        # a semaphore is created again when the configuration reload changes the limit
+        if slot is None or slot[0] != limit:
+            slot = _user_slots[username] = (limit, BoundedSemaphore(limit))
+        return slot[1]
+
+
+def find_nsr(nsr_id):
     try:
-        delete(find(Nsr, _id=nsr_id))
+        return find(Nsr, _id=nsr_id)
     except NoResultFound:
-        pass
+        return None
 
 
 def _update_nsr(nsr):
     logger.debug("Checking resources of user %s, nsr id %s" % (nsr.username, nsr.id))
-    ob_client = OBClient(nsr.username)
+    ob_client = get_ob_client(nsr.username)
     # check if the OBClient has a project ID. if not, something went wrong and the nsr is ignored for now.
     if ob_client.project_id is None:
         logger.error('The OBClient for user {} has no project ID. This should never happen. Does the user still exist '
@@ -104,7 +290,8 @@ def _update_nsr(nsr):
             'Baton?'.format(
                 nsr.username))
     try:
-        nsr_new = ob_client.get_nsr(nsr.id)
+        with _user_slot(nsr.username):
+            nsr_new = ob_client.get_nsr(nsr.id)
     except Exception as e:
         logger.error(
             'Exception while fetching the NSR with ID {} of user {}. Removing it.'.format(nsr.id, nsr.username))
@@ -120,11 +307,76 @@ def _update_nsr(nsr):
     if 'error' in nsr_new_dict:
         logger.error('Exception while updating the NSR with ID {} of user {}: {}'.format(nsr.id, nsr.username, nsr_new_dict.get('error')))
         return None
-    add_nsr_to_check(nsr.username, nsr_new_dict)
+    # an NSR removed meanwhile, e.g. released, is not tracked again
+    upsert(Nsr, _nsr_values(nsr.username, nsr_new_dict), insert=False)
     logger.debug("Status is: %s" % nsr_new_dict.get('status'))
     return nsr_new
 
 
+def _check_nsr(nsr):
+    try:
+        return _update_nsr(nsr)
+    except NfvManagerNotFoundException:
+        remove_nsr_to_check(nsr.id)
+        return None
+
+
+def nsr_digest(nsr):
+    """
+    Digest of the part of an NSR reported to the experiment manager: the status, the VNFR states and the IPs.
+
+    :param nsr: the NSR as dict
+    :return: the hex digest
+     :rtype: str
+    """
+    vnfrs = []
+    for vnfr in nsr.get('vnfr') or []:
+        vnfcs = []
+        for vdu in vnfr.get('vdu') or []:
+            for vnfc_instance in vdu.get('vnfc_instance') or []:
+                vnfcs.append([vnfc_instance.get('hostname'), vnfc_instance.get('state'),
+                              sorted(json.dumps(ip, sort_keys=True) for ip in vnfc_instance.get('ips') or []),
+                              sorted(json.dumps(ip, sort_keys=True) for ip in vnfc_instance.get('floatingIps') or [])])
+        vnfrs.append([vnfr.get('name'), vnfr.get('status'), sorted(vnfcs, key=str)])
+    state = [nsr.get('status'), sorted(vnfrs, key=str)]
+    return hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+
+
+def _sync_user_nsrs(username, nsrs):
+    """
+    Fetch all the NSRs of a user with one request and match them with the tracked ones. The tracked NSRs that
+    disappeared from the NFVO are removed.
+
+    :param username: the user owning the NSRs
+    :param nsrs: the tracked Nsr of the user
+    :return: list of tuples (nsr, updated NSR as JSON string or None if it is gone or could not be fetched, True if it
+     is gone)
+    """
+    ob_client = get_ob_client(username)
+    if ob_client.project_id is None:
+        logger.error('The OBClient for user {} has no project ID. Does the user still exist in Open Baton? Removing '
+                     'its NSRs.'.format(username))
+        found = {}
+    else:
+        try:
+            with _user_slot(username):
+                found = {nsr.get('id'): nsr for nsr in ob_client.list_nsrs()}
+        except Exception as e:
+            logger.error('Exception while listing the NSRs of user {}: {}'.format(username, e))
+            return [(nsr, None, False) for nsr in nsrs]
+    result = []
+    for nsr in nsrs:
+        nsr_new = found.get(nsr.id)
+        if nsr_new is None:
+            logger.info('The NSR with ID {} of user {} is not in Open Baton anymore. Removing it.'.format(nsr.id,
+                                                                                                       username))
+            remove_nsr_to_check(nsr.id)
+            result.append((nsr, None, True))
+        else:
+            result.append((nsr, json.dumps(nsr_new), False))
+    return result
+
+
 def try_delete_vnfd(vnfd_id, ob_client):
     try:
         ob_client.delete_vnfd(vnfd_id)
@@ -140,28 +392,41 @@ def try_delete_nsd(nsd_id, ob_client):
 
 
 def try_delete_nsr(nsr, ob_client):
+    """
+    Request the deletion of the NSR, the ReleaseReaper checks when the NSR is actually removed.
+    """
     try:
         ob_client.delete_nsr(nsr.get('id'))
     except:
         raise NfvResourceDeleteException('Not able to delete NSR with id: %s' % nsr.get('id'))
-    timer = 500
-    time.sleep(5)
+
+
+def wait_for_nsrs_removal(ob_client, timeout):
+    """
+    Poll the NSRs of the project until they are all removed.
+
+    :param ob_client: the OBClient of the project
+    :param timeout: maximum seconds to wait
+    :return: True if all the NSRs were removed, False otherwise
+    """
+    deadline = time.time() + timeout
+    delay = 1
     while True:
-        try:
-            nsr = json.loads(ob_client.get_nsr(nsr.get('id')))
-            if timer == 0:
-                raise NfvResourceDeleteException('Not able to delete NSR with id: %s' % nsr.get('id'))
-        except NfvoException:
-            return
-        timer -= 1
-        time.sleep(2)
+        if not ob_client.list_nsrs():
+            return True
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 10)
 
 
 def remove_all(ob_client, force=False):
-    if force or get_config('system', 'delete-all', CONFIG_FILE_PATH, 'false').lower() == 'true':
+    if force or get_config_bool('system', 'delete-all', False):
         logger.debug("removing everything!")
         for _nsr in ob_client.list_nsrs():
             ob_client.delete_nsr(_nsr.get('id'))
+        if not wait_for_nsrs_removal(ob_client, get_config_int('system', 'delete-nsr-timeout', 60)):
+            logger.warning("The NSRs were not removed in time, trying to remove the rest anyway")
         for _nsd in ob_client.list_nsds():
             ob_client.delete_nsd(_nsd.get('id'))
         for _vim_instance in ob_client.list_vim_instances():
@@ -174,17 +439,156 @@ class NfvManager(AbstractManager):
             logger.error('Configuration file {} is missing.'.format(config_file_path))
             sys.exit(1)
         super().__init__(config_file_path)
+        self.last_update_stats = {
+            'duration': 0.0,
+            'polled': 0,
+            'sent': 0,
+        }
+        self.status_scheduler = StatusScheduler(interval=10, max_interval=600)
+        self.release_reaper = ReleaseReaper(on_untracked=lambda nsr_id: self._forget_sent([nsr_id]))
+        self.apply_config()
+        # {nsr_id: digest of the state last sent to the experiment manager}
+        self._sent_digests = {}
+        self._sent_digests_lock = RLock()
         with open(self.get_config_value('system', 'softfire-public-key'), "r") as sosftfire_ssh_pub_key:
             self.softfire_pub_key = sosftfire_ssh_pub_key.read().strip()
 
+    def get_config_value(self, section, key, default=None):
+        return get_config_value(section, key, default, config_file_path=self.config_file_path)
+
+    def get_config_int(self, section, key, default):
+        return get_config_int(section, key, default, config_file_path=self.config_file_path)
+
+    def get_config_float(self, section, key, default):
+        return get_config_float(section, key, default, config_file_path=self.config_file_path)
+
+    def get_config_bool(self, section, key, default):
+        return get_config_bool(section, key, default, config_file_path=self.config_file_path)
+
+    def apply_config(self):
+        """
+        Pass the configuration to the status scheduler and to the release reaper, to be called again after
+        reload_config.
+        """
+        self.status_scheduler.interval = self.get_config_int('system', 'update-delay', 10)
+        self.status_scheduler.max_interval = self.get_config_int('system', 'update-backoff-max', 600)
+        self.status_scheduler.factor = self.get_config_float('system', 'update-backoff-factor', 2)
+        self.status_scheduler.grace_checks = self.get_config_int('system', 'update-backoff-grace-checks', 6)
+        self.release_reaper.timeout = self.get_config_int('system', 'release-timeout', 1000)
+
+    def events_enabled(self):
+        return self.get_config_bool('system', 'event-listener', False)
+
+    def _subscribe_events(self, ob_client):
+        if not self.events_enabled():
+            return
+        endpoint = 'http://%s:%s/events' % (self.get_config_value('system', 'ip', 'localhost'),
+                                            self.get_config_value('system', 'event-listener-port', '5053'))
+        try:
+            ob_client.subscribe_events(endpoint, NSR_EVENT_ACTIONS)
+        except Exception as e:
+            logger.error("Not able to subscribe to Open Baton events, relying on polling: %s" % e)
+
+    def _unsubscribe_events(self, ob_client):
+        if not self.events_enabled():
+            return
+        try:
+            ob_client.unsubscribe_events()
+        except Exception as e:
+            logger.error("Not able to remove the Open Baton event subscriptions: %s" % e)
+
+    def handle_event(self, event):
+        """
+        Refresh the tracked NSR an Open Baton event refers to and notify the experiment manager if its state changed.
+        The event is only a trigger: the endpoint is not authenticated, so the NSR is always fetched from the NFVO.
+
+        :param event: the event as dict, containing action and payload
+        """
+        payload = event.get('payload')
+        if not isinstance(payload, dict) or not payload.get('id'):
+            logger.debug("Ignoring event %s without NSR" % event.get('action'))
+            return
+        tracked = find_nsr(payload.get('id'))
+        if tracked is None or self.release_reaper.is_releasing(tracked.id):
+            logger.debug("Ignoring event %s of untracked NSR %s" % (event.get('action'), payload.get('id')))
+            return
+        tracked = Nsr(id=tracked.id, username=tracked.username, status=tracked.status)
+        logger.debug("Received event %s for NSR %s" % (event.get('action'), tracked.id))
+
+        nsr_new = _check_nsr(tracked)
+        if nsr_new is None:
+            if find_nsr(tracked.id) is None:
+                self._forget_sent([tracked.id])
+            return
+        nsr = json.loads(nsr_new)
+        self.status_scheduler.checked(tracked.id, nsr.get('status'))
+        if self._mark_sent(nsr):
+            self._send_changes({tracked.username: [nsr_new]})
+
+    def send_update(self):
+        self._send_changes(self._update_status())
+
+    def _send_changes(self, resources_per_experimenter):
+        """
+        Send the NSRs marked as sent to the experiment manager, forgetting them if the delivery fails.
+
+        :param resources_per_experimenter: the NSRs as JSON strings per user
+        """
+        try:
+            self._send_status(resources_per_experimenter)
+        except:
+            # everything not delivered is sent again at the next cycle
+            self._forget_sent([json.loads(res).get('id') for resources in resources_per_experimenter.values() for res
+                               in resources])
+            raise
+
+    def _mark_sent(self, nsr):
+        """
+        Remember the state of an NSR about to be sent to the experiment manager.
+
+        :param nsr: the NSR as dict
+        :return: False if the same state was already sent, True otherwise
+        """
+        digest = nsr_digest(nsr)
+        with self._sent_digests_lock:
+            if self._sent_digests.get(nsr.get('id')) == digest:
+                return False
+            self._sent_digests[nsr.get('id')] = digest
+            return True
+
+    def _forget_sent(self, nsr_ids):
+        with self._sent_digests_lock:
+            for nsr_id in nsr_ids:
+                self._sent_digests.pop(nsr_id, None)
+
+    def _send_status(self, resources_per_experimenter):
+        if not len(resources_per_experimenter):
+            return
+        target = '%s:%s' % (self.get_config_value("system", "experiment_manager_ip", "localhost"),
+                            self.get_config_value("system", "experiment_manager_port", "5051"))
+        channel = grpc.insecure_channel(target)
+        stub = messages_pb2_grpc.RegistrationServiceStub(channel=channel)
+        manager_name = self.get_config_value('system', 'name')
+        for username, resources in resources_per_experimenter.items():
+            rpc_res = []
+            for res in resources:
+                rpc_res.append(messages_pb2.Resource(content=json.dumps(json.loads(res))))
+            status_message = messages_pb2.StatusMessage(
+                resources=rpc_res,
+                username=username,
+                manager_name=manager_name
+            )
+            stub.update_status(status_message)
+
     def validate_resources(self, user_info=None, payload=None) -> None:
 
         request_dict = yaml.load(payload)
         logger.info("Validating %s " % request_dict)
 
         resource_id = request_dict.get("properties").get('resource_id')
-        available_nsds = get_available_nsds()
-        if resource_id not in available_nsds.keys():
+        nsd_catalogue = get_nsd_catalogue()
+        canonical_resource_id = nsd_catalogue.resolve(resource_id)
+        if canonical_resource_id is None:
             temp_csar_location = self.get_config_value('system', 'temp-csar-location',
                                                        '/etc/softfire/experiment-nsd-csar').rstrip('/')
             nsd_location = '{}/{}/{}.csar'.format(temp_csar_location, user_info.name, resource_id)
@@ -194,16 +598,21 @@ class NfvManager(AbstractManager):
             if not os.path.exists(nsd_location) and not file_name:
                 raise NfvResourceValidationError(
                     message="Resource id %s not in the available ones %s and no CSAR file provided" % (
-                        resource_id, list(available_nsds.keys())))
+                        resource_id, list(nsd_catalogue.as_dict().keys())))
+            if file_name:
+                nsd_location = '{}/{}/{}'.format(temp_csar_location, user_info.name, file_name[6:])
+            if os.path.exists(nsd_location):
+                csar_metadata = inspect_csar(nsd_location)
+                validate_testbeds(csar_metadata, request_dict.get("properties").get("testbeds"))
 
         else:
             testbeds = request_dict.get("properties").get("testbeds")
+            vnf_types = nsd_catalogue.vnf_types(canonical_resource_id)
             for vnf_type in testbeds.keys():
-                if vnf_type not in available_nsds.get(resource_id).get("vnf_types") and vnf_type.upper() != "ANY":
+                if vnf_type not in vnf_types and vnf_type.upper() != "ANY":
                     raise NfvResourceValidationError(
                         message="Testbeds properties must be a dict containing the vnf type of the NS chosen or ANY, "
-                                "%s not included in the possibilities %s" % (
-                                    vnf_type, available_nsds.get("resource_id").get("vnf_types")))
+                                "%s not included in the possibilities %s" % (vnf_type, sorted(vnf_types)))
         pass
 
     def refresh_resources(self, user_info):
@@ -215,7 +624,7 @@ class NfvManager(AbstractManager):
              :rtype list
             """
         result = []
-        ob_client = OBClient(user_info.name)
+        ob_client = get_ob_client(user_info.name)
         images, networks, flavours = ob_client.list_images_network_flavors()
 
         for image in images:
@@ -266,7 +675,7 @@ class NfvManager(AbstractManager):
             :return: the nsr deployed
              :rtype: ProvideResourceResponse
             """
-        ob_client = OBClient(user_info.name)
+        ob_client = get_ob_client(user_info.name)
         logger.debug("Payload is \n%s" % payload)
         resource_dict = json.loads(payload)
         logger.debug("Received %s " % resource_dict)
@@ -278,29 +687,56 @@ class NfvManager(AbstractManager):
         file_name = resource_dict.get("properties").get("file_name")
         nsd_name = resource_dict.get("properties").get("nsd_name")
 
-        ob_client.import_key(self.softfire_pub_key, 'softfire-key')
-        nsr_keys_to_use = ['softfire-key']
-        if ssh_pub_key:
-            logger.debug("creating user-key called: %s" % nsd_name)
-            ob_client.import_key(ssh_pub_key.strip(), nsd_name)
-            nsr_keys_to_use.append(nsd_name)
-
-        # temp_csar_location = "{}/{}".format(
-        #     self.get_config_value("system", "temp-csar-location", '/etc/softfire/experiment-nsd-csar').rstrip('/'),
-        #     resource_id)
-        available_nsds = get_available_nsds()
-        nsd_chosen = available_nsds.get(resource_id)
+        nsd_catalogue = get_nsd_catalogue()
+        # the packages folder is named after the resource id as written in the available NSDs
+        canonical_resource_id = nsd_catalogue.resolve(resource_id)
+        nsd_chosen = nsd_catalogue.get(canonical_resource_id)
         packages_location = "%s/%s" % (
-            self.get_config_value("system", "packages-location", '/etc/softfire/packages').rstrip('/'), resource_id)
-        vnfds = []
+            self.get_config_value("system", "packages-location", '/etc/softfire/packages').rstrip('/'),
+            canonical_resource_id)
         testbeds = resource_dict.get("properties").get("testbeds")
 
         logger.debug("Checking if nsd_chosen is not none: %s" % nsd_chosen)
         logger.debug("and if path %s exists: %s" % (packages_location, os.path.exists(packages_location)))
 
-        if nsd_chosen and os.path.exists(packages_location):
-            for package in [f for f in listdir(packages_location) if isfile(join(packages_location, f))]:
-                vnfd = ob_client.upload_package(join(packages_location, package), package.split('.')[0])
+        # the placement is computed from the local descriptors, so that a wrong mapping fails before any NFVO call
+        use_packages = nsd_chosen and os.path.exists(packages_location)
+        if use_packages:
+            vdu_names = nsd_chosen.get("vnf_types") or []
+        else:
+            # nsd resource was added by the user and is not available for everyone
+            if not file_name:
+                raise MissingFileException("Resource id %s has no packages and no CSAR file was provided" % resource_id)
+            temp_csar_location = self.get_config_value("system", "temp-csar-location",
+                                                       "/etc/softfire/experiment-nsd-csar")
+            csar_nsd_file_path = "{}/{}/{}".format(
+                temp_csar_location.rstrip('/'), user_info.name, file_name[6:])
+            if not os.path.exists(csar_nsd_file_path):
+                raise MissingFileException("File %s was not found" % csar_nsd_file_path)
+            # already parsed during the validation, the metadata are cached by file hash
+            vdu_names = inspect_csar(csar_nsd_file_path).get('vdu_names')
+        vdu_vim_instances = ob_client.plan_vdu_vim_instances(vdu_names, testbeds)
+        nsr_keys_to_use = ['softfire-key']
+        if ssh_pub_key:
+            nsr_keys_to_use.append(nsd_name)
+        body = json.dumps({
+            "vduVimInstances": vdu_vim_instances,
+            "keys": nsr_keys_to_use,
+            "monitoringIp": monitoring_ip
+        })
+        logger.debug("Body is %s" % body)
+
+        ob_client.import_key(self.softfire_pub_key, 'softfire-key')
+        if ssh_pub_key:
+            logger.debug("creating user-key called: %s" % nsd_name)
+            ob_client.import_key(ssh_pub_key.strip(), nsd_name)
+
+        if use_packages:
+            packages = [(join(packages_location, f), f.split('.')[0]) for f in listdir(packages_location) if
+                        isfile(join(packages_location, f))]
+            vnfds = []
+            for vnfd in ob_client.upload_packages(
+                    packages, max_workers=self.get_config_int('system', 'package-upload-threads', 4)):
                 vnfds.append({
                     'id': vnfd.get('id')
                 })
@@ -319,77 +755,25 @@ class NfvManager(AbstractManager):
             nsd = ob_client.create_nsd(nsd)
 
             logger.debug("Created NSD: %s" % nsd)
-            vdu_vim_instances = {}
-
-            if "ANY" in testbeds.keys():
-                for vdu_name in nsd_chosen.get("vnf_types"):
-                    vdu_vim_instances[vdu_name] = ["vim-instance-%s" % vim_name for vim_name in testbeds.values()]
-            else:
-                for vdu_name in nsd_chosen.get("vnf_types"):
-                    vdu_vim_instances[vdu_name] = ["vim-instance-%s" % testbeds.get(vdu_name)]
-
-            body = json.dumps({
-                "vduVimInstances": vdu_vim_instances,
-                "keys": nsr_keys_to_use,
-                "monitoringIp": monitoring_ip
-            })
-            logger.debug("Body is %s" % body)
-            try:
-                nsr = ob_client.create_nsr(nsd.get('id'), body=body)
-            except Exception as e:
-                logger.error('Exception while deploying NSR from NSD: {}'.format(e))
-                logger.debug('Delete NSD {}'.format(nsd.get('id')))
-                try:
-                    ob_client.delete_nsd(nsd.get('id'))
-                except Exception as e2:
-                    logger.error('Could not remove NSD {}: {}'.format(nsd.get('id'), e2))
-                raise e
-
-            add_nsr_to_check(user_info.name, nsr)
-
         else:
-            # nsd resource was added by the user and is not available for everyone
-            temp_csar_location = self.get_config_value("system", "temp-csar-location",
-                                                       "/etc/softfire/experiment-nsd-csar")
-            csar_nsd_file_path = "{}/{}/{}".format(
-                temp_csar_location.rstrip('/'), user_info.name, file_name[6:])
-            if os.path.exists(csar_nsd_file_path):
-                nsd = ob_client.create_nsd_from_csar(csar_nsd_file_path)
-                logger.debug("Created NSD: %s" % nsd.get('name'))
-            else:
-                raise MissingFileException("File %s was not found" % csar_nsd_file_path)
-            vdu_vim_instances = {}
-
-            if "ANY" in testbeds.keys():
-                for vnfd in nsd.get('vnfd'):
-                    for vdu in vnfd.get('vdu'):
-                        vdu_vim_instances[vdu.get('name')] = ["vim-instance-%s" % vim_name for vim_name in
-                                                              testbeds.values()]
-            else:
-                logger.debug("Adding testbed mapping vdu : %s" % testbeds)
-                for vdu_name, testbed in testbeds.items():
-                    vdu_vim_instances[vdu_name] = ["vim-instance-%s" % testbed]
-            body = json.dumps({
-                "vduVimInstances": vdu_vim_instances,
-                "keys": nsr_keys_to_use,
-                "monitoringIp": monitoring_ip
-            })
-            logger.debug("Deploy NSR with body: %s" % body)
-
-            if nsd:
-                try:
-                    nsr = ob_client.create_nsr(nsd.get('id'), body=body)
-                except Exception as e:
-                    logger.error('Exception while deploying NSR from NSD {}: {}'.format(nsd.get('id'), e))
-                    logger.debug('Delete NSD {}'.format(nsd.get('id')))
-                    try:
-                        ob_client.delete_nsd(nsd.get('id'))
-                    except Exception as e2:
-                        logger.error('Could not remove NSD {}: {}'.format(nsd.get('id'), e2))
-                    raise e
-                add_nsr_to_check(user_info.name, nsr)
+            nsd = ob_client.create_nsd_from_csar(csar_nsd_file_path)
+            logger.debug("Created NSD: %s" % nsd.get('name'))
 
+        try:
+            nsr = ob_client.create_nsr(nsd.get('id'), body=body)
+        except Exception as e:
+            logger.error('Exception while deploying NSR from NSD {}: {}'.format(nsd.get('id'), e))
+            logger.debug('Delete NSD {}'.format(nsd.get('id')))
+            try:
+                ob_client.delete_nsd(nsd.get('id'))
+            except Exception as e2:
+                logger.error('Could not remove NSD {}: {}'.format(nsd.get('id'), e2))
+            raise e
 
+        add_nsr_to_check(user_info.name, nsr)
+        self._mark_sent(nsr)
+        self.status_scheduler.reset(nsr.get('id'))
+        self._subscribe_events(ob_client)
 
         if isinstance(nsr, dict):
             nsr = json.dumps(nsr)
@@ -415,6 +799,7 @@ class NfvManager(AbstractManager):
             'description': 'the project for user %s' % username
         }
         project = ob_client.create_project(project)
+        invalidate_ob_client(project.get('name'))
         user = {
             'username': username,
             'password': password,
@@ -428,7 +813,7 @@ class NfvManager(AbstractManager):
             ]
         }
         logger.debug("Create openbaton project %s" % project)
-        ob_client = OBClient(project.get('name'))
+        ob_client = get_ob_client(project.get('name'))
         user = ob_client.create_user(user)
         logger.debug("Create openbaton user %s" % user)
 
@@ -437,15 +822,13 @@ class NfvManager(AbstractManager):
 
         testbed_tenants = {}
         if os_tenants:
+            vim_instances = ob_client.create_vim_instances(
+                {testbed_name: v.get('vim_instance') for testbed_name, v in os_tenants.items()})
             for testbed_name, v in os_tenants.items():
-                tenant_id = v.get('tenant_id')
-                vim_instance = v.get('vim_instance')
-                try:
-                    vi = ob_client.create_vim_instance(vim_instance)
+                vi = vim_instances.get(testbed_name)
+                if vi:
                     logger.debug("created vim instance with id: %s" % vi.get('id'))
-                except NfvoException:
-                    logger.warning("Not able to upload vim %s" % testbed_name)
-                testbed_tenants[TESTBED_MAPPING[testbed_name]] = tenant_id
+                testbed_tenants[TESTBED_MAPPING[testbed_name]] = v.get('tenant_id')
 
         for k, v in testbed_tenants.items():
             user_info.testbed_tenants[k] = v
@@ -462,20 +845,26 @@ class NfvManager(AbstractManager):
             :return: list of ResourceMetadata
             """
         result = []
+        nsd_catalogue = get_nsd_catalogue()
 
         if user_info and user_info.name:
-            ob_client = OBClient(user_info.name)
+            ob_client = get_ob_client(user_info.name)
 
             for nsd in ob_client.list_nsds():
-                result.append(messages_pb2.ResourceMetadata(nsd.name,
-                                                            nsd.get('description') or get_available_nsds[
-                                                                nsd.name.lower()].get(
+                available_nsd = nsd_catalogue.get(nsd.get('name'))
+                if available_nsd is None:
+                    # NSDs created in the NFVO by other means are not offered
+                    logger.debug("Skipping NSD %s not in the available NSDs" % nsd.get('name'))
+                    continue
+                cardinality = CARDINALITY.get(nsd.get('name').lower(), available_nsd.get('cardinality', -1))
+                result.append(messages_pb2.ResourceMetadata(resource_id=nsd.get('name'),
+                                                            description=nsd.get('description') or available_nsd.get(
                                                                 'description'),
-                                                            CARDINALITY[nsd.name.lower()]))
+                                                            cardinality=int(cardinality)))
 
-                result.extend(self.refresh_resources(user_info))
+            result.extend(self.refresh_resources(user_info))
 
-        for k, v in get_available_nsds().items():
+        for k, v in nsd_catalogue.as_dict().items():
             testbed = v.get('testbed')
             node_type = v.get('node_type')
             cardinality = int(v.get('cardinality'))
@@ -498,7 +887,7 @@ class NfvManager(AbstractManager):
             :type user_info: UserInfo
            :return: None
            """
-        ob_client = OBClient(user_info.name)
+        ob_client = get_ob_client(user_info.name)
 
         logger.info('Deleting resources for user: {}'.format(user_info.name))
         logger.debug('Received this payload: {}'.format(payload))
@@ -512,6 +901,7 @@ class NfvManager(AbstractManager):
             if nsr:
                 try:
                     remove_nsr_to_check(nsr.get('id'))
+                    self._forget_sent([nsr.get('id')])
                 except:
                     pass
             return
@@ -519,6 +909,7 @@ class NfvManager(AbstractManager):
             logger.debug('The payload does not seem to be an NSR so the resource was probably not yet deployed and '
                          'nothing has to be removed from Open Baton.')
             return
+        self.status_scheduler.reset(nsr.get('id'))
         nsd_id = nsr.get('descriptor_reference')
         try:
             nsd = json.loads(ob_client.get_nsd(nsd_id))
@@ -531,58 +922,125 @@ class NfvManager(AbstractManager):
 
         try:
             try_delete_nsr(nsr, ob_client)
-
-            try_delete_nsd(nsd_id, ob_client)
+            # the NSD is removed by the release reaper once the NSR is gone
             # TODO to be added if cascade is not enabled
             # for vnfd_id in vnfd_ids:
             #     self.try_delete_vnfd(vnfd_id, ob_client)
         except NfvResourceDeleteException as e:
             traceback.print_exc()
             logger.error("...ignoring...")
+            remove_nsr_to_check(nsr.get('id'))
+            self._forget_sent([nsr.get('id')])
+            return
 
-        remove_nsr_to_check(nsr.get('id'))
-        logger.info("Removed resource %s" % nsr.get('name'))
+        self.release_reaper.submit(user_info.name, nsr.get('id'), nsd_id)
+        self._forget_sent([nsr.get('id')])
+        # the events are subscribed per project, they are not needed anymore once the last NSR is released
+        if not [tracked for tracked in iter_nsrs(username=user_info.name) if
+                not self.release_reaper.is_releasing(tracked.id)]:
+            self._unsubscribe_events(ob_client)
+        logger.info("Removing resource %s" % nsr.get('name'))
+
+    def get_release_job(self, nsr_id):
+        """
+        Return the state of the release of the NSR.
 
-        # remove_all(ob_client)
+        :param nsr_id: the id of the NSR
+        :return: dict with nsr_id, nsd_id, username, status (DELETING, DONE or FAILED), error, submitted and finished
+        or None if the NSR was not released recently
+        """
+        return self.release_reaper.get_job(nsr_id)
 
     def _update_status(self) -> dict:
-        result = {}
-        for nsrs in get_nsrs_to_check():
-            if isinstance(nsrs, list):
-                for nsr in nsrs:
-                    if not result.get(nsr.username):
-                        result[nsr.username] = []
-                    if nsr.status.lower() not in ['active']:
-                        try:
-                            nsr_new = _update_nsr(nsr)
-                        except NfvManagerNotFoundException:
-                            remove_nsr_to_check(nsr.id)
-                            continue
-                        if nsr_new is not None:
-                            result[nsr.username].append(nsr_new)
-            else:
-                if not result.get(nsrs.username):
-                    result[nsrs.username] = []
-                if nsrs.status.lower() not in ['active']:
-                    try:
-                        nsr_new = _update_nsr(nsrs)
-                    except NfvManagerNotFoundException:
-                        remove_nsr_to_check(nsrs.id)
-                        continue
-                    if nsr_new is not None:
-                        result[nsrs.username].append(nsr_new)
+        start = time.time()
+        tracked_by_user = {}
+        due_users = set()
+        due = self.status_scheduler.pop_due(start)
+        # only the NSRs not yet ACTIVE are loaded
+        for nsr in get_nsrs_to_check():
+            if not self.release_reaper.is_releasing(nsr.id):
+                tracked_by_user.setdefault(nsr.username, []).append(nsr)
+                if nsr.id in due or not self.status_scheduler.is_scheduled(nsr.id):
+                    due_users.add(nsr.username)
+        self.status_scheduler.retain(set(nsr.id for nsrs in tracked_by_user.values() for nsr in nsrs))
+
+        # the NSRs of a user are all fetched with one request, so all the tracked ones are checked
+        nsrs_by_user = {username: tracked_by_user.get(username) for username in due_users}
+        result = self._sync_nsrs(nsrs_by_user, update_scheduler=True)
+
+        self.last_update_stats = {
+            'duration': time.time() - start,
+            'polled': sum(len(nsrs) for nsrs in nsrs_by_user.values()),
+            'projects': len(nsrs_by_user),
+            'sent': sum(len(resources) for resources in result.values()),
+        }
+        logger.debug("Status update cycle polled %d NSRs of %d projects and sent %d in %.2f seconds" % (
+            self.last_update_stats.get('polled'), self.last_update_stats.get('projects'),
+            self.last_update_stats.get('sent'), self.last_update_stats.get('duration')))
+        return result
 
+    def reconcile(self):
+        """
+        Resume the pending releases and align all the tracked NSRs, ACTIVE ones included, with the NFVO, removing the
+        ones that disappeared while the NFV Manager was not running, and send the ones that changed to the experiment
+        manager. Meant to be run at startup.
+
+        :return: the NSRs that changed, per user
+        """
+        self.release_reaper.resume()
+        nsrs_by_user = {}
+        for nsr in iter_nsrs():
+            nsrs_by_user.setdefault(nsr.username, []).append(nsr)
+        logger.info("Reconciling the NSRs of %d projects with the NFVO" % len(nsrs_by_user))
+        resources_per_experimenter = self._sync_nsrs(nsrs_by_user)
+        self._send_changes(resources_per_experimenter)
+        return resources_per_experimenter
+
+    def _sync_nsrs(self, nsrs_by_user, update_scheduler=False):
+        """
+        Fetch the NSRs of every user, in parallel if update-threads > 1, and save the changes with a single commit.
+
+        :param nsrs_by_user: dict username -> list of tracked Nsr
+        :param update_scheduler: True to schedule the next check of the NSRs
+        :return: the NSRs that changed since they were last sent, as JSON strings per user
+        """
+        pool_size = self.get_config_int('system', 'update-threads', 1)
+        if pool_size > 1 and len(nsrs_by_user) > 1:
+            with ThreadPoolExecutor(max_workers=min(pool_size, len(nsrs_by_user))) as executor:
+                futures = [executor.submit(_sync_user_nsrs, username, nsrs) for username, nsrs in
+                           nsrs_by_user.items()]
+                updated = [item for future in futures for item in future.result()]
+        else:
+            updated = [item for username, nsrs in nsrs_by_user.items() for item in _sync_user_nsrs(username, nsrs)]
+
+        # the updates are written with a single commit, skipping the NSRs released meanwhile
+        result = {}
+        nsr_values = []
+        for nsr, nsr_new, gone in updated:
+            if gone:
+                self._forget_sent([nsr.id])
+            if nsr_new is not None:
+                nsr_new_dict = json.loads(nsr_new)
+                # only the NSRs that changed since the last update are sent
+                if self._mark_sent(nsr_new_dict):
+                    result.setdefault(nsr.username, []).append(nsr_new)
+                nsr_values.append(_nsr_values(nsr.username, nsr_new_dict))
+                if update_scheduler:
+                    self.status_scheduler.checked(nsr.id, nsr_new_dict.get('status'))
+            elif update_scheduler:
+                self.status_scheduler.checked(nsr.id, nsr.status)
+        upsert_all(Nsr, nsr_values, insert=False)
         return result
 
     def delete_user(self, user_info):
         logger.debug("Removing user %s" % user_info)
         username = user_info.name
-        ob_client = OBClient(username)
+        ob_client = get_ob_client(username)
+        self._unsubscribe_events(ob_client)
         try:
             remove_all(ob_client, True)
         except:
             pass
-        time.sleep(5)
         try:
             ob_client.delete_user(username=username)
         except:
@@ -591,7 +1049,7 @@ class NfvManager(AbstractManager):
             ob_client.delete_project(ob_project_id=user_info.ob_project_id)
         except:
             pass
-        time.sleep(2)
+        invalidate_ob_client(username)
         try:
             os_utils.delete_tenant_and_user(username=username, testbed_tenants=user_info.testbed_tenants)
         except:
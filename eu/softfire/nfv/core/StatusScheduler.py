@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class StatusScheduler(object):
+    def __init__(self, interval, max_interval, factor=2, grace_checks=6):
+        """
+        Decides when the status of each NSR has to be checked again. The NSRs are kept in a priority queue ordered by
+        the time of their next check. An NSR is checked every interval seconds for the first grace_checks checks
+        after a status change, then the interval grows by factor after every check not changing the status, up to
+        max_interval. NSRs that were never scheduled are always due.
+
+        :param interval: seconds between the checks of a freshly deployed or changed NSR
+        :param max_interval: maximum seconds between two checks
+        :param factor: the backoff multiplier
+        :param grace_checks: number of checks done every interval seconds before backing off
+        """
+        self.interval = interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.grace_checks = grace_checks
+        # {nsr_id: {'next_check': ..., 'status': ..., 'unchanged': ...}}
+        self._schedule = {}
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+
+    def _push(self, nsr_id, next_check):
+        self._schedule[nsr_id]['next_check'] = next_check
+        heapq.heappush(self._queue, (next_check, next(self._counter), nsr_id))
+
+    def is_scheduled(self, nsr_id):
+        with self._lock:
+            return nsr_id in self._schedule
+
+    def pop_due(self, now=None):
+        """
+        Return the ids of the scheduled NSRs whose check is due.
+
+        :param now: the current time, defaults to time.time()
+        :return: set of NSR ids
+        """
+        if now is None:
+            now = time.time()
+        due = set()
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                next_check, _, nsr_id = heapq.heappop(self._queue)
+                entry = self._schedule.get(nsr_id)
+                # entries of removed or rescheduled NSRs stay in the queue until popped
+                if entry and entry.get('next_check') == next_check:
+                    due.add(nsr_id)
+        return due
+
+    def checked(self, nsr_id, status, now=None):
+        """
+        Schedule the next check of an NSR that was just checked.
+
+        :param nsr_id: the id of the NSR
+        :param status: the status the NSR had when checked
+        :param now: the current time, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self._schedule.get(nsr_id)
+            if entry is None or entry.get('status') != status:
+                entry = {'status': status, 'unchanged': 0}
+                self._schedule[nsr_id] = entry
+            else:
+                entry['unchanged'] += 1
+            if entry.get('unchanged') < self.grace_checks:
+                interval = self.interval
+            else:
+                interval = min(self.interval * self.factor ** (entry.get('unchanged') - self.grace_checks + 1),
+                               self.max_interval)
+            self._push(nsr_id, now + interval)
+
+    def reset(self, nsr_id):
+        """
+        Forget the schedule of an NSR, so that it is checked at the next cycle with the shortest interval.
+
+        :param nsr_id: the id of the NSR
+        """
+        with self._lock:
+            self._schedule.pop(nsr_id, None)
+
+    def retain(self, nsr_ids):
+        """
+        Remove the schedule of all the NSRs not in nsr_ids.
+
+        :param nsr_ids: the ids of the NSRs still to be checked
+        """
+        with self._lock:
+            for nsr_id in [_id for _id in self._schedule.keys() if _id not in nsr_ids]:
+                self._schedule.pop(nsr_id)
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Column, PickleType
+from sqlalchemy import String, Column, JSON, Float
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -8,8 +8,31 @@ Base = declarative_base()
 class Nsr(Base):
     __tablename__ = "ns_records"
 
+    id = Column(String(250), primary_key=True)
+    username = Column(String(250), nullable=False, index=True)
+    status = Column(String(250), nullable=False, index=True)
+    # {vnfrName: [hostname]}
+    vnfc_hostnames = Column(JSON)
+    # epoch seconds of the last time the NSR was fetched from the NFVO
+    last_checked = Column(Float, index=True)
+
+
+class VnfPackage(Base):
+    __tablename__ = "vnf_packages"
+
+    # {projectId}-{sha256}
+    id = Column(String(250), primary_key=True)
+    project_id = Column(String(250), nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    vnfd_id = Column(String(250), nullable=False)
+
+
+class ReleaseJob(Base):
+    __tablename__ = "release_jobs"
+
+    # the id of the NSR being released
     id = Column(String(250), primary_key=True)
     username = Column(String(250), nullable=False)
-    status = Column(String(250), nullable=False)
-    # {vnfrName:hostname}
-    vnf_log_url = Column(PickleType)
+    nsd_id = Column(String(250))
+    # epoch seconds of the release request
+    submitted = Column(Float, nullable=False)
@@ -1,40 +1,103 @@
 import logging
+import pickle
 import threading
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.pool import StaticPool
 
-from eu.softfire.nfv.db.entities import Base
-from eu.softfire.nfv.utils.static_config import CONFIG_FILE_PATH
-from eu.softfire.nfv.utils.utils import get_logger
-from sdk.softfire.utils import get_config
+from eu.softfire.nfv.db.entities import Base, Nsr
+from eu.softfire.nfv.utils.utils import get_logger, get_config_value, get_config_int, get_config_bool
 
 logger = get_logger('eu.softfire.tub.repository')
 
-lock = threading.RLock()
-
-db_url = get_config('database', 'url', CONFIG_FILE_PATH, "sqlite:////tmp/nfv-manager.db")
+# the engine is created at import, changing the database options requires a restart
+db_url = get_config_value('database', 'url', "sqlite:////tmp/nfv-manager.db")
 if db_url.startswith("sqlite:"):
-    engine = create_engine(db_url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+    if db_url in ["sqlite://", "sqlite:///:memory:"]:
+        # an in memory database exists only in its connection
+        engine = create_engine(db_url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+    else:
+        engine = create_engine(db_url, connect_args={'check_same_thread': False,
+                                                     'timeout': get_config_int('database', 'busy-timeout', 30)})
+
+
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragma(dbapi_connection, connection_record):
+            # with the write ahead log the readers do not wait for the writer
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
 else:
-    engine = create_engine(db_url)
-debug_echo = (logger.getEffectiveLevel() == logging.DEBUG) and get_config('database', 'show_sql',CONFIG_FILE_PATH,
-                                                                          False).lower() == 'true'
+    engine = create_engine(db_url,
+                           pool_size=get_config_int('database', 'pool-size', 10),
+                           max_overflow=get_config_int('database', 'max-overflow', 10),
+                           pool_recycle=get_config_int('database', 'pool-recycle', 3600),
+                           pool_pre_ping=True)
+debug_echo = (logger.getEffectiveLevel() == logging.DEBUG) and get_config_bool('database', 'show_sql', False)
 engine.echo = debug_echo
+
+
+def _migrate_ns_records(_engine):
+    """
+    Upgrade the ns_records table created by older versions: add the missing columns, convert the VNFC hostnames
+    of each VNFR that were pickled in vnf_log_url as "host1;host2;", and add the missing indexes. The vnf_log_url
+    column is kept unused, since SQLite can drop a column only from version 3.35; it is cleared once converted.
+    """
+    table = Nsr.__table__
+    columns = [column.get('name') for column in inspect(_engine).get_columns(table.name)]
+    missing_columns = [column for column in table.columns if column.name not in columns]
+    with _engine.begin() as connection:
+        if missing_columns:
+            logger.info("Adding the columns %s to table %s" % ([column.name for column in missing_columns],
+                                                                table.name))
+        for column in missing_columns:
+            connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table.name, column.name, column.type.compile(dialect=_engine.dialect))))
+        if 'vnf_log_url' in columns:
+            rows = connection.execute(
+                text('SELECT id, vnf_log_url FROM %s WHERE vnf_log_url IS NOT NULL' % table.name)).fetchall()
+            if rows:
+                logger.info("Converting the VNFC hostnames of %d NSRs" % len(rows))
+            for _id, vnf_log_url in rows:
+                vnfc_hostnames = {}
+                if vnf_log_url:
+                    for vnfr_name, hostnames in pickle.loads(vnf_log_url).items():
+                        vnfc_hostnames[vnfr_name] = [hostname for hostname in hostnames.split(';') if hostname]
+                connection.execute(table.update().where(table.c.id == _id).values(vnfc_hostnames=vnfc_hostnames))
+                connection.execute(text('UPDATE %s SET vnf_log_url = NULL WHERE id = :id' % table.name), {'id': _id})
+    for index in table.indexes:
+        index.create(_engine, checkfirst=True)
+
+
 Base.metadata.create_all(engine)
-session_factory = sessionmaker(bind=engine)
+_migrate_ns_records(engine)
+# the entities are not expired on commit, so that they can be used after the end of the unit of work
+session_factory = sessionmaker(bind=engine, expire_on_commit=False)
 _session = scoped_session(session_factory)
-session = _session()
+_local = threading.local()
 
 
 @contextmanager
 def get_db_session():
-    with lock:
-        with session.no_autoflush:
-            yield session
+    """
+    Give the session of the current thread. Nested calls share the session, which is closed at the end of the
+    outermost one.
+    """
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    try:
+        se = _session()
+        with se.no_autoflush:
+            yield se
+    finally:
+        _local.depth = depth
+        if depth == 0:
+            _session.remove()
 
 
 def rollback():
@@ -65,6 +128,56 @@ def save(entity, _clazz=None):
         se.commit()
 
 
+def _apply_values(se, _clazz, values, insert):
+    entity = se.query(_clazz).get(values.get('id'))
+    if entity is None:
+        if insert:
+            se.add(_clazz(**values))
+        return
+    # only the columns that changed are written
+    for key, value in values.items():
+        if getattr(entity, key) != value:
+            setattr(entity, key, value)
+
+
+def upsert(_clazz, values, insert=True):
+    """
+    Insert the entity or update only the changed columns of the existing one, in a single transaction.
+
+    :param _clazz: the entity class
+    :param values: dict of column values, containing the id
+    :param insert: False to only update the entity if it still exists
+    """
+    upsert_all(_clazz, [values], insert)
+
+
+def upsert_all(_clazz, values_list, insert=True):
+    """
+    Insert or update several entities of the same class with a single commit.
+
+    :param _clazz: the entity class
+    :param values_list: list of dict of column values, containing the id
+    :param insert: False to only update the entities still existing
+    """
+    if not values_list:
+        return
+    with get_db_session() as se:
+        for attempt in range(2):
+            try:
+                for values in values_list:
+                    _apply_values(se, _clazz, values, insert)
+                se.commit()
+                return
+            except IntegrityError:
+                se.rollback()
+                # an entity was inserted concurrently, the second attempt updates it
+                if attempt:
+                    raise
+            except:
+                se.rollback()
+                raise
+
+
 def delete(entity):
     with get_db_session() as se:
         se.delete(entity)
@@ -89,4 +202,43 @@ def find_by_element_value(_clazz, element, value):
     with get_db_session() as se:
         res = se.query(_clazz).filter(element == value).all()
         se.commit()
-    return res
\ No newline at end of file
+    return res
+
+
+def iter_filtered(_clazz, *criteria, batch_size=None):
+    """
+    Stream the entities matching all the criteria, loading them from the database in batches. Do not write to the
+    database from the same thread while iterating.
+
+    :param _clazz: the entity class
+    :param criteria: SQLAlchemy filter expressions
+    :param batch_size: number of rows fetched at a time, defaults to query-batch-size
+    :return: generator of entities
+    """
+    with get_db_session() as se:
+        query = se.query(_clazz).filter(*criteria).order_by(_clazz.id)
+        for entity in query.yield_per(batch_size or get_config_int('database', 'query-batch-size', 100)):
+            yield entity
+
+
+def iter_nsrs(statuses=None, exclude_statuses=None, username=None, checked_before=None, batch_size=None):
+    """
+    Stream the NSRs matching all the given filters, evaluated by the database.
+
+    :param statuses: only the NSRs in one of these status
+    :param exclude_statuses: only the NSRs not in any of these status
+    :param username: only the NSRs of this user
+    :param checked_before: only the NSRs never checked or last checked before this epoch time
+    :param batch_size: number of rows fetched at a time, defaults to query-batch-size
+    :return: generator of Nsr
+    """
+    criteria = []
+    if statuses is not None:
+        criteria.append(Nsr.status.in_(statuses))
+    if exclude_statuses is not None:
+        criteria.append(Nsr.status.notin_(exclude_statuses))
+    if username is not None:
+        criteria.append(Nsr.username == username)
+    if checked_before is not None:
+        criteria.append(or_(Nsr.last_checked.is_(None), Nsr.last_checked < checked_before))
+    return iter_filtered(Nsr, *criteria, batch_size=batch_size)
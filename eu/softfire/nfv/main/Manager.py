@@ -1,15 +1,46 @@
+import signal
+
 from sdk.softfire.main import start_manager
 
+from eu.softfire.nfv.core.EventListener import EventListener
 from eu.softfire.nfv.core.NfvManager import NfvManager, UpdateStatusThread
+from eu.softfire.nfv.utils.ob_utils import IndexRefreshThread
+from eu.softfire.nfv.utils.utils import reload_config, get_logger
+
+logger = get_logger(__name__)
+
+
+def _reload(nfv_manager):
+    reload_config()
+    nfv_manager.apply_config()
+    logger.info("Configuration reloaded")
 
 
 def start():
     nfv_manager = NfvManager('/etc/softfire/nfv-manager.ini')
+    signal.signal(signal.SIGHUP, lambda signum, frame: _reload(nfv_manager))
+    try:
+        nfv_manager.reconcile()
+    except Exception as e:
+        logger.error("got error while reconciling the NSRs with the NFVO: %s" % e)
     thread = UpdateStatusThread(nfv_manager)
     thread.start()
+    nfv_manager.release_reaper.start()
+    index_thread = IndexRefreshThread()
+    index_thread.start()
+    event_listener = None
+    if nfv_manager.events_enabled():
+        event_listener = EventListener(nfv_manager.handle_event,
+                                       nfv_manager.get_config_value('system', 'event-listener-port', '5053'),
+                                       nfv_manager.get_config_value('system', 'ip', 'localhost'))
+        event_listener.start()
     try:
         start_manager(nfv_manager)
     finally:
+        if event_listener:
+            event_listener.stop()
+        index_thread.stop()
+        nfv_manager.release_reaper.stop()
         thread.stop()
         thread.join()
 
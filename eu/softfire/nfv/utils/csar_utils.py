@@ -0,0 +1,135 @@
+import posixpath
+import threading
+import zipfile
+from collections import OrderedDict
+
+import yaml
+
+from eu.softfire.nfv.utils.exceptions import NfvResourceValidationError
+from eu.softfire.nfv.utils.utils import get_logger, get_file_sha256
+
+logger = get_logger(__name__)
+
+TOSCA_META_PATH = 'TOSCA-Metadata/TOSCA.meta'
+# the definitions are read in memory, so they must stay small even if the CSAR contains huge images
+MAX_DEFINITIONS_SIZE = 10 * 1024 * 1024
+VDU_TYPES = ['tosca.nodes.nfv.VDU']
+VNF_TYPES = ['openbaton.type.VNF', 'tosca.nodes.nfv.VNF']
+CSAR_CACHE_SIZE = 100
+
+# {sha256: metadata}, least recently used first
+_csar_metadata = OrderedDict()
+_csar_metadata_lock = threading.Lock()
+
+
+def inspect_csar(file_path):
+    """
+    Validate the structure of a CSAR and return its metadata, without extracting it. Only the zip central directory,
+    the TOSCA metadata and the definitions are read. The metadata are cached by the SHA-256 of the file.
+
+    :param file_path: the path of the CSAR
+    :return: dict with sha256, entry_definitions, nsd_name, vnfs ({vnf name: vnf type}) and vdu_names (set)
+     :rtype: dict
+    """
+    sha256 = get_file_sha256(file_path)
+    with _csar_metadata_lock:
+        metadata = _csar_metadata.get(sha256)
+        if metadata is not None:
+            _csar_metadata.move_to_end(sha256)
+            return metadata
+    metadata = _parse_csar(file_path)
+    metadata['sha256'] = sha256
+    with _csar_metadata_lock:
+        _csar_metadata[sha256] = metadata
+        while len(_csar_metadata) > CSAR_CACHE_SIZE:
+            _csar_metadata.popitem(last=False)
+    return metadata
+
+
+def _parse_csar(file_path):
+    try:
+        csar = zipfile.ZipFile(file_path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise NfvResourceValidationError(message="The CSAR %s is not a valid zip file: %s" % (
+            posixpath.basename(file_path), e))
+    with csar:
+        members = {info.filename: info for info in csar.infolist()}
+        entry_definitions = _read_entry_definitions(csar, members)
+        definitions = _read_definitions(csar, members, entry_definitions)
+        node_templates = (definitions.get('topology_template') or {}).get('node_templates') or {}
+        metadata = definitions.get('metadata') or {}
+        # the imported definitions can contain the VNFs of the NS
+        for imported in definitions.get('imports') or []:
+            if isinstance(imported, dict):
+                imported = list(imported.values())[0]
+            imported_path = posixpath.normpath(posixpath.join(posixpath.dirname(entry_definitions), str(imported)))
+            if imported_path in members:
+                imported_definitions = _read_definitions(csar, members, imported_path)
+                node_templates.update((imported_definitions.get('topology_template') or {}).get('node_templates') or {})
+
+    vnfs = {}
+    vdu_names = set()
+    for name, node_template in node_templates.items():
+        node_type = (node_template or {}).get('type')
+        if node_type in VDU_TYPES:
+            vdu_names.add(name)
+        elif node_type in VNF_TYPES:
+            vnfs[name] = node_type
+    if not vdu_names:
+        raise NfvResourceValidationError(message="The CSAR %s does not define any VDU" % posixpath.basename(file_path))
+    logger.debug("Inspected CSAR %s: VNFs %s, VDUs %s" % (file_path, list(vnfs.keys()), vdu_names))
+    return {
+        'entry_definitions': entry_definitions,
+        'nsd_name': metadata.get('ID') or metadata.get('name'),
+        'vnfs': vnfs,
+        'vdu_names': vdu_names,
+    }
+
+
+def _read_entry_definitions(csar, members):
+    if TOSCA_META_PATH not in members:
+        raise NfvResourceValidationError(message="The CSAR does not contain %s" % TOSCA_META_PATH)
+    tosca_meta = _read_member(csar, members.get(TOSCA_META_PATH)).decode('utf-8', 'replace')
+    for line in tosca_meta.splitlines():
+        key, _, value = line.partition(':')
+        if key.strip() == 'Entry-Definitions':
+            entry_definitions = value.strip()
+            if entry_definitions not in members:
+                raise NfvResourceValidationError(
+                    message="The entry definitions %s are missing in the CSAR" % entry_definitions)
+            return entry_definitions
+    raise NfvResourceValidationError(message="%s does not contain the Entry-Definitions" % TOSCA_META_PATH)
+
+
+def _read_definitions(csar, members, path):
+    try:
+        definitions = yaml.safe_load(_read_member(csar, members.get(path)))
+    except yaml.YAMLError as e:
+        raise NfvResourceValidationError(message="The definitions %s of the CSAR are not valid yaml: %s" % (path, e))
+    if not isinstance(definitions, dict):
+        raise NfvResourceValidationError(message="The definitions %s of the CSAR are not a yaml map" % path)
+    return definitions
+
+
+def _read_member(csar, info):
+    if info.file_size > MAX_DEFINITIONS_SIZE:
+        raise NfvResourceValidationError(
+            message="The file %s of the CSAR is bigger than %d bytes" % (info.filename, MAX_DEFINITIONS_SIZE))
+    with csar.open(info) as f:
+        return f.read(MAX_DEFINITIONS_SIZE + 1)
+
+
+def validate_testbeds(metadata, testbeds):
+    """
+    Check that the testbeds mapping of the request refers only to VDUs of the CSAR, or is ANY.
+
+    :param metadata: the CSAR metadata returned by inspect_csar
+    :param testbeds: dict VDU name -> testbed name
+    """
+    if not testbeds:
+        return
+    for vdu_name in testbeds.keys():
+        if vdu_name.upper() != "ANY" and vdu_name not in metadata.get('vdu_names'):
+            raise NfvResourceValidationError(
+                message="Testbeds properties must be a dict containing the VDU names of the CSAR or ANY, "
+                        "%s not included in the possibilities %s" % (vdu_name, sorted(metadata.get('vdu_names'))))
@@ -1,14 +1,111 @@
 import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
 
 from org.openbaton.cli.agents.agents import OpenBatonAgentFactory
 from org.openbaton.cli.errors.errors import NfvoException
-from sdk.softfire.utils import get_config
+from sqlalchemy.orm.exc import NoResultFound
 
-from eu.softfire.nfv.utils.static_config import CONFIG_FILE_PATH
-from eu.softfire.nfv.utils.utils import get_logger
+from eu.softfire.nfv.db.entities import VnfPackage
+from eu.softfire.nfv.db.repositories import find, upsert, delete
+from eu.softfire.nfv.utils.exceptions import NfvResourceValidationError
+from eu.softfire.nfv.utils.utils import get_logger, get_config_value, get_config_int, get_config_bool, \
+    get_file_sha256
 
 logger = get_logger(__name__)
 
+# {project_name: (OBClient, creation time)}, least recently used first
+_ob_clients = OrderedDict()
+_ob_clients_lock = threading.RLock()
+
+
+class NfvoIndex(object):
+    def __init__(self, list_function, key='name'):
+        """
+        In memory index of NFVO entities. It is filled with one listing on first use, refreshed by the
+        IndexRefreshThread and kept up to date by the changes done through the OBClient.
+
+        :param list_function: function returning the list of entities (as dict)
+        :param key: the entity attribute used as index key
+        """
+        self._list_function = list_function
+        self._key = key
+        self._entries = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self.last_refresh = 0
+
+    def refresh(self):
+        with self._refresh_lock:
+            entries = {}
+            for entity in self._list_function():
+                entries[entity.get(self._key)] = entity
+            with self._lock:
+                self._entries = entries
+                self.last_refresh = time.time()
+
+    def is_filled(self):
+        return self._entries is not None
+
+    def get(self, name, refresh_on_miss=True):
+        """
+        Return the entity with this name. In case of a miss, the index is refreshed at most once every
+        index-miss-refresh-interval seconds, for entities created outside of the NFV Manager.
+
+        :param name: the value of the key attribute
+        :param refresh_on_miss: False to never refresh the index in case of a miss
+        :return: the entity or None
+        """
+        if not self.is_filled():
+            self.refresh()
+        with self._lock:
+            entity = self._entries.get(name)
+        if entity is None and refresh_on_miss and \
+                time.time() - self.last_refresh > get_config_int('nfvo', 'index-miss-refresh-interval', 10):
+            self.refresh()
+            with self._lock:
+                entity = self._entries.get(name)
+        return entity
+
+    def put(self, entity):
+        with self._lock:
+            if self._entries is not None:
+                self._entries[entity.get(self._key)] = entity
+
+    def remove(self, name):
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(name, None)
+
+    def remove_by_id(self, _id):
+        with self._lock:
+            if self._entries is not None:
+                for name, entity in list(self._entries.items()):
+                    if entity.get('id') == _id:
+                        self._entries.pop(name)
+
+
+class IndexRefreshThread(Thread):
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(get_config_int('nfvo', 'index-refresh-interval', 300)):
+            for index in [project_index, user_index]:
+                if index.is_filled():
+                    try:
+                        index.refresh()
+                    except Exception as e:
+                        logger.error("got error while refreshing the NFVO index: %s" % e)
+
+    def stop(self):
+        self.stopped.set()
+
 
 def get_vim_instance_test():
     return {
@@ -37,14 +134,15 @@ class OBClient(object):
 
         :param project_name: the project of a specific user.
         """
-        https = get_config("nfvo", "https", CONFIG_FILE_PATH).lower() == 'true'
+        self.project_id = None
+        https = get_config_value("nfvo", "https").lower() == 'true'
 
-        username = get_config("nfvo", "username", CONFIG_FILE_PATH)
+        username = get_config_value("nfvo", "username")
 
-        password = get_config("nfvo", "password", CONFIG_FILE_PATH)
+        password = get_config_value("nfvo", "password")
 
-        nfvo_ip = get_config("nfvo", "ip", CONFIG_FILE_PATH)
-        nfvo_port = get_config("nfvo", "port", CONFIG_FILE_PATH)
+        nfvo_ip = get_config_value("nfvo", "ip")
+        nfvo_port = get_config_value("nfvo", "port")
         self.agent_factory = OpenBatonAgentFactory(nfvo_ip=nfvo_ip,
                                                    nfvo_port=nfvo_port,
                                                    https=https,
@@ -57,11 +155,13 @@ class OBClient(object):
             if self.project_id is None and project_name is not None:
                 logger.warning('Project ID is None. No project found with the name {}'.format(project_name))
 
+        self.vim_index = NfvoIndex(self.list_vim_instances)
+        self.events_subscribed = False
+
     def _get_project_id(self, project_name):
-        project_agent = self.agent_factory.get_project_agent()
-        for project in json.loads(project_agent.find()):
-            if project.get('name') == project_name:
-                return project.get('id')
+        project = project_index.get(project_name)
+        if project:
+            return project.get('id')
         return None
 
     def list_nsds(self):
@@ -74,34 +174,98 @@ class OBClient(object):
         return self.agent_factory.get_ns_records_agent(self.project_id).delete(nsr_id)
 
     def create_project(self, project):
-        for p in json.loads(self.list_projects()):
-            if p.get('name') == project.get('name'):
-                return p
+        p = project_index.get(project.get('name'))
+        if p:
+            return p
         if isinstance(project, dict):
             project = json.dumps(project)
         ob_project = self.agent_factory.get_project_agent().create(project)
+        project_index.put(ob_project)
         self.project_id = ob_project.get('id')
         return ob_project
 
     def create_user(self, user):
-
-        for us in json.loads(self.list_users()):
-            if us.get('username') == user.get('username'):
-                return us
+        us = user_index.get(user.get('username'))
+        if us:
+            return us
 
         if isinstance(user, dict):
             user = json.dumps(user)
-        return self.agent_factory.get_user_agent(self.project_id).create(user)
+        ob_user = self.agent_factory.get_user_agent(self.project_id).create(user)
+        user_index.put(ob_user)
+        return ob_user
 
     def create_vim_instance(self, vim_instance):
-        for vi in self.list_vim_instances():
-            if vi.get('name') == vim_instance.get('name'):
-                return vi
+        vi = self.vim_index.get(vim_instance.get('name'))
+        if vi:
+            return vi
+        return self._upload_vim_instance(vim_instance)
+
+    def create_vim_instances(self, vim_instances):
+        """
+        Register several vim instances with a single listing of the existing ones, uploading the missing ones in
+        parallel.
+
+        :param vim_instances: dict of vim instances (as dict) by any key
+        :return: dict of the created or already existing vim instances by the same key, None if the upload failed
+        """
+        self.vim_index.refresh()
+        result = {}
+        to_upload = {}
+        for key, vim_instance in vim_instances.items():
+            vi = self.vim_index.get(vim_instance.get('name'), refresh_on_miss=False)
+            if vi:
+                result[key] = vi
+            else:
+                to_upload[key] = vim_instance
+        if not to_upload:
+            return result
+        with ThreadPoolExecutor(max_workers=len(to_upload)) as executor:
+            futures = [(key, executor.submit(self._upload_vim_instance, vim_instance)) for key, vim_instance in
+                       to_upload.items()]
+            for key, future in futures:
+                try:
+                    result[key] = future.result()
+                except NfvoException:
+                    logger.warning("Not able to upload vim %s" % to_upload[key].get('name'))
+                    result[key] = None
+        return result
+
+    def plan_vdu_vim_instances(self, vdu_names, testbeds):
+        """
+        Compute the vduVimInstances of an NSR from the locally known VDU names, checking that the vim instances of
+        the chosen testbeds are registered for this project. The NSD does not need to be onboarded yet.
+
+        :param vdu_names: the names of the VDUs of the NS
+        :param testbeds: dict VDU name -> testbed name, or ANY -> testbed name
+        :return: dict VDU name -> list of vim instance names
+        """
+        if not testbeds:
+            raise NfvResourceValidationError(message="No testbeds mapping provided")
+        for testbed in set(testbeds.values()):
+            if not self.vim_index.get("vim-instance-%s" % testbed):
+                raise NfvResourceValidationError(
+                    message="Testbed %s is not available for this experimenter" % testbed)
+        vdu_vim_instances = {}
+        if "ANY" in testbeds.keys():
+            for vdu_name in vdu_names:
+                vdu_vim_instances[vdu_name] = ["vim-instance-%s" % vim_name for vim_name in testbeds.values()]
+        else:
+            for vdu_name, testbed in testbeds.items():
+                if vdu_name not in vdu_names:
+                    raise NfvResourceValidationError(
+                        message="VDU %s not included in the possibilities %s" % (vdu_name, sorted(vdu_names)))
+                vdu_vim_instances[vdu_name] = ["vim-instance-%s" % testbed]
+        return vdu_vim_instances
+
+    def _upload_vim_instance(self, vim_instance):
         if isinstance(vim_instance, dict):
             vim_instance = json.dumps(vim_instance)
 
         logger.debug("Posting vim %s" % vim_instance)
-        return self.agent_factory.get_vim_instance_agent(self.project_id).create(vim_instance)
+        vi = self.agent_factory.get_vim_instance_agent(self.project_id).create(vim_instance)
+        self.vim_index.put(vi)
+        return vi
 
     def list_users(self):
         return self.agent_factory.get_user_agent(self.project_id).find()
@@ -148,18 +312,95 @@ class OBClient(object):
                 )
         return images, networks, flavors
 
-    def upload_package(self, package_path, name=None):
+    def upload_package(self, package_path, name=None, get_vnfd_ids=None):
+        """
+        Upload a VNF package. If the upload fails because the VNFD exists already, the existing one is returned.
+
+        :param package_path: the path of the package
+        :param name: the name of the VNFD in the package
+        :param get_vnfd_ids: function returning the dict VNFD name -> VNFD id of the project, by default the NSDs are
+        listed
+        :return: the VNFD, or a dict with only its id if it existed already
+        """
+        dedup = get_config_bool('system', 'package-dedup', True)
+        if dedup:
+            sha256 = get_file_sha256(package_path)
+            vnfd_id = self._get_uploaded_vnfd_id(sha256)
+            if vnfd_id:
+                logger.debug("Package %s was already uploaded as VNFD %s" % (package_path, vnfd_id))
+                return {"id": vnfd_id}
         package_agent = self.agent_factory.get_vnf_package_agent(self.project_id)
         try:
-            return package_agent.create(package_path)
+            vnfd = package_agent.create(package_path)
         except NfvoException as e:
             if not name:
                 raise e
-            for nsd in json.loads(self.agent_factory.get_ns_descriptor_agent(self.project_id).find()):
-                for vnfd in nsd.get('vnfd'):
-                    if vnfd.get('name') == name:
-                        return {"id": vnfd.get('id')}
-            raise e
+            if get_vnfd_ids is None:
+                get_vnfd_ids = self.get_vnfd_ids_by_name
+            vnfd_id = get_vnfd_ids().get(name)
+            if not vnfd_id:
+                raise e
+            vnfd = {"id": vnfd_id}
+        if dedup:
+            self._set_uploaded_vnfd_id(sha256, vnfd.get('id'))
+        return vnfd
+
+    def _get_uploaded_vnfd_id(self, sha256):
+        """
+        Return the id of the VNFD previously created in the project from a package with this hash, if it still exists.
+        """
+        try:
+            vnf_package = find(VnfPackage, _id='%s-%s' % (self.project_id, sha256))
+        except NoResultFound:
+            return None
+        vnfd_id = vnf_package.vnfd_id
+        try:
+            self.agent_factory.get_vnf_descriptor_agent(self.project_id).find(vnfd_id)
+        except NfvoException:
+            logger.debug("VNFD %s does not exist anymore" % vnfd_id)
+            delete(vnf_package)
+            return None
+        return vnfd_id
+
+    def _set_uploaded_vnfd_id(self, sha256, vnfd_id):
+        # concurrent uploads of the same package in the same project write the same row
+        upsert(VnfPackage, {
+            'id': '%s-%s' % (self.project_id, sha256),
+            'project_id': self.project_id,
+            'sha256': sha256,
+            'vnfd_id': vnfd_id,
+        })
+
+    def upload_packages(self, packages, max_workers=4):
+        """
+        Upload several VNF packages in parallel. The NSDs are listed at most once, when the first upload fails.
+
+        :param packages: list of tuples (package path, VNFD name)
+        :param max_workers: maximum number of uploads running at the same time
+        :return: the list of VNFDs, in the same order as the packages
+        """
+        vnfd_ids = []
+        vnfd_ids_lock = threading.Lock()
+
+        def get_vnfd_ids():
+            with vnfd_ids_lock:
+                if not vnfd_ids:
+                    vnfd_ids.append(self.get_vnfd_ids_by_name())
+                return vnfd_ids[0]
+
+        if not packages:
+            return []
+        with ThreadPoolExecutor(max_workers=max(min(max_workers, len(packages)), 1)) as executor:
+            futures = [executor.submit(self.upload_package, package_path, name, get_vnfd_ids) for package_path, name
+                       in packages]
+            return [future.result() for future in futures]
+
+    def get_vnfd_ids_by_name(self):
+        vnfd_ids = {}
+        for nsd in self.list_nsds():
+            for vnfd in nsd.get('vnfd'):
+                vnfd_ids.setdefault(vnfd.get('name'), vnfd.get('id'))
+        return vnfd_ids
 
     def create_nsd(self, nsd):
         if isinstance(nsd, dict):
@@ -202,15 +443,95 @@ class OBClient(object):
         return self.agent_factory.get_csarnsd_agent(self.project_id).create(location)
 
     def delete_user(self, username):
-        for u in json.loads(self.list_users()):
-            if u.get('username') == username:
-                self.agent_factory.get_user_agent(self.project_id).delete(u.get('id'))
+        u = user_index.get(username)
+        if u:
+            self.agent_factory.get_user_agent(self.project_id).delete(u.get('id'))
+            user_index.remove(username)
 
     def delete_project(self, ob_project_id):
         self.agent_factory.get_project_agent().delete(ob_project_id)
+        project_index.remove_by_id(ob_project_id)
 
     def list_nsrs(self):
         return json.loads(self.agent_factory.get_ns_records_agent(self.project_id).find())
 
+    def subscribe_events(self, endpoint, actions):
+        """
+        Register REST event endpoints for all the NSRs of the project, once per OBClient.
+
+        :param endpoint: the url the NFVO will post the events to
+        :param actions: the list of Open Baton actions to subscribe to
+        """
+        if self.events_subscribed:
+            return
+        event_agent = self.agent_factory.get_event_agent(self.project_id)
+        existing = [e.get('name') for e in json.loads(event_agent.find())]
+        for action in actions:
+            name = 'nfv-manager-%s' % action.lower()
+            if name not in existing:
+                logger.debug("Subscribing to %s events of project %s" % (action, self.project_id))
+                event_agent.create(json.dumps({
+                    'name': name,
+                    'type': 'REST',
+                    'endpoint': endpoint,
+                    'event': action,
+                    'projectId': self.project_id
+                }))
+        self.events_subscribed = True
+
+    def unsubscribe_events(self):
+        """
+        Remove the event subscriptions created by subscribe_events in the project.
+        """
+        event_agent = self.agent_factory.get_event_agent(self.project_id)
+        for event in json.loads(event_agent.find()):
+            if (event.get('name') or '').startswith('nfv-manager-'):
+                logger.debug("Removing the subscription %s of project %s" % (event.get('name'), self.project_id))
+                event_agent.delete(event.get('id'))
+        self.events_subscribed = False
+
     def delete_vim_instance(self, _vim_id):
         self.agent_factory.get_vim_instance_agent(self.project_id).delete(_vim_id)
+        self.vim_index.remove_by_id(_vim_id)
+
+
+project_index = NfvoIndex(lambda: json.loads(get_ob_client().list_projects()))
+user_index = NfvoIndex(lambda: json.loads(get_ob_client().list_users()), key='username')
+
+
+def get_ob_client(project_name=None):
+    """
+    Return the shared OBClient of the project, creating a new one if it is not cached or the cached one expired.
+    The clients are kept for client-cache-ttl seconds and at most client-cache-size of them are kept.
+
+    :param project_name: the project of a specific user.
+    :return: the OBClient
+     :rtype: OBClient
+    """
+    now = time.time()
+    with _ob_clients_lock:
+        cached = _ob_clients.get(project_name)
+        if cached and now - cached[1] < get_config_int('nfvo', 'client-cache-ttl', 600):
+            _ob_clients.move_to_end(project_name)
+            return cached[0]
+    ob_client = OBClient(project_name)
+    if project_name and ob_client.project_id is None:
+        # the project does not exist (yet), do not remember it
+        return ob_client
+    with _ob_clients_lock:
+        _ob_clients[project_name] = (ob_client, now)
+        _ob_clients.move_to_end(project_name)
+        cache_size = get_config_int('nfvo', 'client-cache-size', 100)
+        while len(_ob_clients) > cache_size:
+            _ob_clients.popitem(last=False)
+    return ob_client
+
+
+def invalidate_ob_client(project_name):
+    """
+    Remove the cached OBClient of the project, to be called when the project is created or deleted.
+
+    :param project_name: the project of a specific user.
+    """
+    with _ob_clients_lock:
+        _ob_clients.pop(project_name, None)
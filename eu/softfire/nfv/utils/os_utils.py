@@ -1,24 +1,217 @@
 import logging
+import threading
+import time
 import traceback
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from functools import partial
 
 import keystoneclient
 import neutronclient
 from glanceclient import Client as Glance
 from keystoneauth1 import session
-from keystoneauth1.exceptions.http import Conflict
+from keystoneauth1.exceptions.http import Conflict, NotFound
 from keystoneauth1.identity import v2, v3
 from neutronclient.common.exceptions import IpAddressGenerationFailureClient
 from neutronclient.v2_0.client import Client as Neutron
 from novaclient.client import Client as Nova
 
 from eu.softfire.nfv.utils.exceptions import OpenstackClientError
-from eu.softfire.nfv.utils.utils import get_logger, get_config, get_openstack_credentials, get_testbed_name_from_id
+from eu.softfire.nfv.utils.utils import get_logger, get_config_value, get_config_int, get_config_float, \
+    get_openstack_credentials, get_testbed_name_from_id
 
 logger = get_logger(__name__)
 
 NETWORKS = ["mgmt", "net_a", "net_b", "net_c", "net_d", "private", "softfire-internal"]
 sec_group_name = 'ob_sec_group'
 
+# ports removed through the router they are attached to
+ROUTER_INTERFACE_OWNERS = ['network:router_interface', 'network:router_interface_distributed',
+                           'network:ha_router_replicated_interface']
+# ports removed by Neutron together with the resource owning them
+PORTS_REMOVED_WITH_OWNER = ['network:router_gateway', 'network:floatingip', 'network:dhcp']
+
+# {testbed_name: seconds} of the last project creation on each testbed
+provisioning_durations = {}
+
+# {(auth_url, api_version, username, password, project): keystoneauth1 Session}, least recently used first
+_os_sessions = OrderedDict()
+_os_sessions_lock = threading.Lock()
+
+
+def get_os_session(key, create_auth):
+    """
+    Return the Keystone session cached for the key, creating it with the auth plugin returned by create_auth if
+    missing. The session keeps its HTTP connections open and its auth plugin reuses the token until it is about to
+    expire, so all the clients of the same user and project share one token.
+
+    :param key: tuple identifying the credentials and the scope, the project is its last element
+    :param create_auth: function returning a new keystoneauth1 auth plugin
+    :return: the session
+     :rtype: keystoneauth1.session.Session
+    """
+    with _os_sessions_lock:
+        os_session = _os_sessions.get(key)
+        if os_session is not None:
+            _os_sessions.move_to_end(key)
+            return os_session
+        os_session = session.Session(auth=create_auth())
+        _os_sessions[key] = os_session
+        cache_size = get_config_int('system', 'os-session-cache-size', 100)
+        while len(_os_sessions) > cache_size:
+            _os_sessions.popitem(last=False)
+        return os_session
+
+
+def invalidate_os_sessions(project):
+    """
+    Remove the cached sessions scoped to a project.
+
+    :param project: the id of the project, or the name of the tenant for Keystone v2
+    """
+    with _os_sessions_lock:
+        for key in [key for key in _os_sessions.keys() if key[-1] == project]:
+            _os_sessions.pop(key)
+
+
+def _get_ttl(ttl, key, default):
+    # read at every use, so that reload_config applies to the existing indexes
+    return get_config_int('system', key, default) if ttl is None else ttl
+
+
+def _get_entity_name(entity):
+    return getattr(entity, 'username', None) or entity.name
+
+
+class OSIndex(object):
+    def __init__(self, ttl=None, miss_refresh_interval=None):
+        """
+        Cached index by name of an OpenStack collection that cannot be filtered by the API. The whole collection is
+        listed at most once every ttl seconds, or on a miss at most once every miss_refresh_interval seconds.
+
+        :param ttl: seconds after which the index is listed again, os-index-ttl if None
+        :param miss_refresh_interval: minimum seconds between two listings caused by a miss,
+         os-index-miss-refresh-interval if None
+        """
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._entries = None
+        self._last_refresh = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self, list_function):
+        self._entries = {_get_entity_name(entity): entity for entity in list_function()}
+        self._last_refresh = time.time()
+
+    def get(self, name, list_function):
+        """
+        Return the entity with this name.
+
+        :param name: the name of the entity
+        :param list_function: function listing the whole collection, used to fill the index
+        :return: the entity or None
+        """
+        with self._lock:
+            age = time.time() - self._last_refresh
+            if self._entries is None or age > _get_ttl(self.ttl, 'os-index-ttl', 3600):
+                self._refresh(list_function)
+            elif name not in self._entries and age > _get_ttl(self.miss_refresh_interval,
+                                                              'os-index-miss-refresh-interval', 10):
+                self._refresh(list_function)
+            return self._entries.get(name)
+
+    def put(self, entity):
+        with self._lock:
+            if self._entries is not None:
+                self._entries[_get_entity_name(entity)] = entity
+
+    def remove(self, name):
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(name, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+
+# {(auth_url, collection): OSIndex}
+_os_indexes = {}
+_os_indexes_lock = threading.Lock()
+
+
+def get_os_index(auth_url, collection):
+    """
+    Return the index of a collection of the OpenStack testbed reachable at auth_url.
+
+    :param auth_url: the Keystone URL identifying the testbed
+    :param collection: the name of the collection, e.g. users
+    :return: the index
+     :rtype: OSIndex
+    """
+    with _os_indexes_lock:
+        return _os_indexes.setdefault((auth_url, collection), OSIndex())
+
+
+class TestbedDirectory(object):
+    def __init__(self, ttl=None, miss_refresh_interval=None):
+        """
+        Snapshot of the entities of a testbed that the provisioning needs for every experimenter and that almost
+        never change: the admin user, the admin and member roles and the external network. It is loaded on first use
+        and reloaded after ttl seconds, or when a missing entity is requested at most once every
+        miss_refresh_interval seconds.
+
+        :param ttl: seconds after which the snapshot is loaded again, os-directory-ttl if None
+        :param miss_refresh_interval: minimum seconds between two loads caused by a missing entity,
+         os-index-miss-refresh-interval if None
+        """
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._snapshot = None
+        self._last_load = 0
+        self._lock = threading.Lock()
+
+    def _load(self, os_client):
+        member_role = os_client.get_role('_member_') or os_client.get_role('member')
+        ext_net_name = os_client.testbed.get('ext_net_name') or 'softfire-network'
+        ext_nets = os_client.get_admin_neutron().list_networks(name=ext_net_name,
+                                                              **{'router:external': True})['networks']
+        self._snapshot = {
+            'admin_user': os_client.get_user(),
+            'admin_role': os_client.get_role('admin'),
+            'member_role': member_role,
+            'ext_net': ext_nets[0] if ext_nets else None,
+        }
+        self._last_load = time.time()
+        logger.debug("Loaded the directory of testbed %s" % os_client.testbed_name)
+
+    def get(self, os_client, name):
+        """
+        Return an entity of the snapshot.
+
+        :param os_client: an admin OSClient of the testbed, used to load the snapshot
+        :param name: one of admin_user, admin_role, member_role and ext_net
+        :return: the entity or None if it does not exist
+        """
+        with self._lock:
+            age = time.time() - self._last_load
+            if self._snapshot is None or age > _get_ttl(self.ttl, 'os-directory-ttl', 86400):
+                self._load(os_client)
+            elif self._snapshot.get(name) is None and age > _get_ttl(self.miss_refresh_interval,
+                                                                     'os-index-miss-refresh-interval', 10):
+                self._load(os_client)
+            return self._snapshot.get(name)
+
+
+# {testbed_name: TestbedDirectory}
+_testbed_directories = {}
+_testbed_directories_lock = threading.Lock()
+
+
+def get_testbed_directory(testbed_name):
+    with _testbed_directories_lock:
+        return _testbed_directories.setdefault(testbed_name, TestbedDirectory())
+
 
 class OSClient(object):
     def __init__(self, testbed_name, testbed, tenant_name=None, project_id=None):
@@ -43,22 +236,23 @@ class OSClient(object):
         if self.api_version == 3 and not self.admin_project_id:
             raise OpenstackClientError("Missing project id required if using v3")
 
-        self.neutron = None
-        self.nova = None
-        self.glance = None
+        self._keystone = None
+        self._neutron = None
+        self._nova = None
+        self._glance = None
+        self._os_tenant_id = None
         self.keypair = None
         self.sec_group = None
-        self.os_tenant_id = None
 
         logger.debug("Log level is: %s and DEBUG is %s" % (logger.getEffectiveLevel(), logging.DEBUG))
         if logger.getEffectiveLevel() == logging.DEBUG:
             logging.basicConfig(level=logging.DEBUG)
 
-        if not tenant_name and not project_id:
-
-            self.keystone = self._create_keystone_client()
-            logger.debug("Created Keystone client %s" % self.keystone)
-        else:
+        # the service clients are created on first use, so constructing an OSClient does not contact OpenStack;
+        # the scope of the keystone client is fixed here, an admin client stays scoped to the admin project
+        self._keystone_scope = self.admin_project_id if self.api_version == 3 else self.admin_tenant_name
+        self._scoped = bool(tenant_name or project_id)
+        if self._scoped:
             self.tenant_name = tenant_name
             self.project_id = project_id
 
@@ -67,74 +261,118 @@ class OSClient(object):
             if self.api_version == 3 and not self.project_id:
                 raise OpenstackClientError("Missing project id required if using v3")
 
-            logger.debug("Creating keystone client")
             if self.api_version == 3:
-                self.keystone = self._create_keystone_client(project_id)
-                self.os_tenant_id = project_id
+                self._keystone_scope = project_id
+                self._os_tenant_id = project_id
             else:
-                self.keystone = self._create_keystone_client(tenant_name)
-                self.os_tenant_id = self.project_id = self._get_tenant_id_from_name(tenant_name)
+                self._keystone_scope = tenant_name
 
-            logger.debug("Created Keystone client %s" % self.keystone)
+    @property
+    def keystone(self):
+        if self._keystone is None:
+            logger.debug("Creating keystone client")
+            self._keystone = self._create_keystone_client(self._keystone_scope)
+            logger.debug("Created Keystone client %s" % self._keystone)
+        return self._keystone
+
+    @keystone.setter
+    def keystone(self, keystone):
+        self._keystone = keystone
+
+    @property
+    def os_tenant_id(self):
+        if self._os_tenant_id is None and self.api_version == 2 and self.tenant_name:
+            self._os_tenant_id = self.project_id = self._get_tenant_id_from_name(self.tenant_name)
+        return self._os_tenant_id
+
+    @os_tenant_id.setter
+    def os_tenant_id(self, os_tenant_id):
+        self._os_tenant_id = os_tenant_id
+
+    @property
+    def nova(self):
+        if self._nova is None and self._scoped:
             self.set_nova(self.os_tenant_id)
+        return self._nova
+
+    @nova.setter
+    def nova(self, nova):
+        self._nova = nova
+
+    @property
+    def neutron(self):
+        if self._neutron is None and self._scoped:
             self.set_neutron(self.os_tenant_id)
+        return self._neutron
+
+    @neutron.setter
+    def neutron(self, neutron):
+        self._neutron = neutron
+
+    @property
+    def glance(self):
+        if self._glance is None and self._scoped:
             self.set_glance(self.os_tenant_id)
+        return self._glance
 
-    def _create_keystone_client(self, project_id=None):
+    @glance.setter
+    def glance(self, glance):
+        self._glance = glance
+
+    def _create_keystone_client(self, scope=None):
         if self.api_version == 3:
-            return keystoneclient.v3.client.Client(session=self._get_session(project_id))
+            return keystoneclient.v3.client.Client(session=self._get_session(scope))
         elif self.api_version == 2:
-            if not project_id:
-                project_id = self.tenant_name or self.admin_tenant_name
-            return keystoneclient.v2_0.client.Client(username=self.username,
-                                                     password=self.password,
-                                                     tenant_name=project_id,
-                                                     auth_url=self.auth_url)
+            return keystoneclient.v2_0.client.Client(session=self._get_session(tenant_name=scope))
 
     def set_nova(self, os_tenant_id):
-        self.nova = Nova('2.1', session=self._get_session(os_tenant_id))
+        self._nova = Nova('2.1', session=self._get_session(os_tenant_id))
 
-    def _get_session(self, tenant_id=None):
+    def _get_session(self, tenant_id=None, tenant_name=None):
         if self.api_version == 2:
-            tenant_name = self.tenant_name or self.admin_tenant_name
-            auth = v2.Password(auth_url=self.auth_url,
-                               username=self.username,
-                               password=self.password,
-                               tenant_name=tenant_name)
+            tenant_name = tenant_name or self.tenant_name or self.admin_tenant_name
+            key = (self.auth_url, 2, self.username, self.password, tenant_name)
+            create_auth = partial(v2.Password, auth_url=self.auth_url,
+                                  username=self.username,
+                                  password=self.password,
+                                  tenant_name=tenant_name)
         elif self.api_version == 3:
             p_id = tenant_id or self.project_id or self.admin_project_id
-            auth = v3.Password(auth_url=self.auth_url,
-                               username=self.username,
-                               password=self.password,
-                               project_id=p_id,
-                               project_domain_name=self.project_domain_name,
-                               user_domain_id=self.user_domain_id)
+            key = (self.auth_url, 3, self.username, self.password, p_id)
+            create_auth = partial(v3.Password, auth_url=self.auth_url,
+                                  username=self.username,
+                                  password=self.password,
+                                  project_id=p_id,
+                                  project_domain_name=self.project_domain_name,
+                                  user_domain_id=self.user_domain_id)
         else:
             msg = "Wrong api version: %s" % self.api_version
             logger.error(msg)
             raise OpenstackClientError(msg)
-        return session.Session(auth=auth)
+        return get_os_session(key, create_auth)
+
+    def get_admin_neutron(self):
+        return Neutron(session=self._get_session(self.admin_project_id, self.admin_tenant_name))
 
     def set_neutron(self, os_tenant_id):
-        # self.os_tenant_id = os_tenant_id
-        if not self.neutron:
-            self.neutron = Neutron(session=self._get_session(os_tenant_id))
+        if not self._neutron:
+            self._neutron = Neutron(session=self._get_session(os_tenant_id))
 
     def get_user(self, username=None):
-        users = self.list_users()
         if username:
             un = username
         else:
             un = self.username
-        for user in users:
-            if user.name == un:
-                return user
+        if self.api_version == 3:
+            users = self.keystone.users.list(name=un)
+            return users[0] if users else None
+        return get_os_index(self.auth_url, 'users').get(un, self.list_users)
 
     def get_role(self, role_to_find):
-        roles = self.list_roles()
-        for role in roles:
-            if role.name == role_to_find:
-                return role
+        if self.api_version == 3:
+            roles = self.keystone.roles.list(name=role_to_find)
+            return roles[0] if roles else None
+        return get_os_index(self.auth_url, 'roles').get(role_to_find, self.list_roles)
 
     def list_roles(self):
         return self.keystone.roles.list()
@@ -145,13 +383,32 @@ class OSClient(object):
         else:
             return self.keystone.tenants.list()
 
+    def get_tenant(self, tenant_name):
+        if self.api_version == 3:
+            projects = self.keystone.projects.list(name=tenant_name)
+            return projects[0] if projects else None
+        index = get_os_index(self.auth_url, 'tenants')
+        tenant = index.get(tenant_name, self.list_tenants)
+        if tenant is None:
+            return None
+        # the tenant may have been deleted outside of the NFV Manager since the index was listed
+        try:
+            return self.keystone.tenants.get(tenant.id)
+        except NotFound:
+            logger.debug("Tenant %s was removed, dropping it from the index" % tenant_name)
+            index.remove(tenant_name)
+            return None
+
     def create_tenant(self, tenant_name, description):
-        self.tenant_name = tenant_name
         if self.api_version == 2:
-            return self.keystone.tenants.create(tenant_name=tenant_name, description=description)
+            tenant = self.keystone.tenants.create(tenant_name=tenant_name, description=description)
+            get_os_index(self.auth_url, 'tenants').put(tenant)
         else:
-            return self.keystone.projects.create(name=tenant_name, description=description,
-                                                 domain=self.user_domain_id)
+            tenant = self.keystone.projects.create(name=tenant_name, description=description,
+                                                   domain=self.user_domain_id)
+        # set only once the tenant exists, the admin clients keep the admin scope
+        self.tenant_name = tenant_name
+        return tenant
 
     def add_user_role(self, user, role, tenant):
         if self.api_version == 2:
@@ -174,14 +431,13 @@ class OSClient(object):
         for keypair in self.list_keypairs(os_tenant_id):
             if keypair.name == keypair_name:
                 return keypair
-        with open(get_config().get('system', 'softfire-public-key'), "r") as sosftfire_ssh_pub_key:
+        with open(get_config_value('system', 'softfire-public-key'), "r") as sosftfire_ssh_pub_key:
             kargs = {"name": keypair_name,
                      "public_key": sosftfire_ssh_pub_key.read()}
             return self.nova.keypairs.create(**kargs)
 
     def get_ext_net(self, ext_net_name='softfire-network'):
-        return [ext_net for ext_net in self.neutron.list_networks()['networks'] if
-                ext_net['router:external'] and ext_net['name'] == ext_net_name][0]
+        return self.neutron.list_networks(name=ext_net_name, **{'router:external': True})['networks'][0]
 
     def allocate_floating_ips(self, fip_num=0, ext_net='softfire-network'):
         body = {
@@ -298,7 +554,7 @@ class OSClient(object):
     def list_sec_group(self, os_project_id):
         if not self.neutron:
             self.set_neutron(os_project_id)
-        return [sec for sec in self.neutron.list_security_groups()['security_groups'] if
+        return [sec for sec in self.neutron.list_security_groups(tenant_id=os_project_id)['security_groups'] if
                 (sec.get('tenant_id') is not None and sec.get('tenant_id') == os_project_id) or (
                     sec.get('project_id') is not None and sec.get('project_id') == os_project_id)]
 
@@ -345,35 +601,30 @@ class OSClient(object):
             return self.glance.images.list()
 
     def _get_tenant_id_from_name(self, tenant_name):
-        if self.api_version == 2:
-            tenants_list = self.keystone.tenants.list()
-        else:
-            tenants_list = self.keystone.projects.list()
-        for tenant in tenants_list:
-            if tenant.name == tenant_name:
-                return tenant.id
+        tenant = self.get_tenant(tenant_name)
+        if tenant:
+            return tenant.id
 
     def set_glance(self, os_tenant_id):
-        self.os_tenant_id = os_tenant_id
-        self.glance = Glance('1', session=self._get_session(os_tenant_id))
+        self._os_tenant_id = os_tenant_id
+        self._glance = Glance('1', session=self._get_session(os_tenant_id))
 
     def _get_tenant_name_from_id(self, os_tenant_id):
-        for t in self.list_tenants():
-            if t.id == os_tenant_id:
-                return t.name
+        try:
+            return self.get_project_from_id(os_tenant_id).name
+        except OpenstackClientError:
+            return None
 
     def create_user(self, username, password=None, tenant_id=None):
-        for u in self.list_users():
-            if hasattr(u, 'username'):
-                u_username = u.username
-            else:
-                u_username = u.name
-            if u_username == username:
-                return u
+        user = self.get_user(username)
+        if user:
+            return user
         if not password:
             raise OpenstackClientError("Paswsord is needed to create user")
         if self.api_version == 2:
-            return self.keystone.users.create(username, password, tenant_id=tenant_id)
+            user = self.keystone.users.create(username, password, tenant_id=tenant_id)
+            get_os_index(self.auth_url, 'users').put(user)
+            return user
         else:
             return self.keystone.users.create(name=username, password=password,
                                               project=self.get_project_from_id(tenant_id))
@@ -427,14 +678,17 @@ class OSClient(object):
         return self.keystone.domains.list()
 
     def get_project_from_id(self, tenant_id):
-        for p in self.list_tenants():
-            if p.id == tenant_id:
-                return p
-        raise OpenstackClientError("Project with id %s not found")
+        try:
+            if self.api_version == 2:
+                return self.keystone.tenants.get(tenant_id)
+            return self.keystone.projects.get(tenant_id)
+        except NotFound:
+            raise OpenstackClientError("Project with id %s not found" % tenant_id)
 
     def delete_user(self, username):
         try:
             self.keystone.users.delete(self.create_user(username=username))
+            get_os_index(self.auth_url, 'users').remove(username)
         except:
             traceback.print_exc()
             logger.error("Not Able to delete user %s" % username)
@@ -442,9 +696,15 @@ class OSClient(object):
     def delete_project(self, project_id):
         try:
             if self.api_version == 2:
+                # the v2 sessions are scoped by tenant name
+                tenant_name = self._get_tenant_name_from_id(project_id)
                 self.keystone.tenants.delete(project_id)
+                get_os_index(self.auth_url, 'tenants').invalidate()
+                if tenant_name:
+                    invalidate_os_sessions(tenant_name)
             else:
                 self.keystone.projects.delete(project_id)
+                invalidate_os_sessions(project_id)
         except:
             traceback.print_exc()
             logger.error("Not Able to delete project %s" % project_id)
@@ -500,6 +760,99 @@ class OSClient(object):
         for sec_group in sec_groups:
             self.neutron.delete_security_group(sec_group.get('id'))
 
+    def get_teardown_tasks(self, project_id, username):
+        """
+        Build the graph of the deletions removing the project, its user and all their network resources, listing
+        every resource type only once.
+
+        :param project_id: the id of the project to remove
+        :param username: the user of the project to remove
+        :return: dict of task name -> (function, set of the names of the tasks that must be finished before)
+        """
+        floating_ips = self.list_floatingips(project_id).get('floatingips')
+        routers = self.list_routers(project_id).get('routers')
+        ports = self.list_ports(project_id).get('ports')
+        networks = self.list_networks(project_id).get('networks')
+        sec_groups = self.list_sec_group(project_id)
+
+        tasks = {}
+        fip_tasks = set()
+        for fip in floating_ips:
+            name = 'floatingip-%s' % fip.get('id')
+            tasks[name] = (partial(self.neutron.delete_floatingip, fip.get('id')), set())
+            fip_tasks.add(name)
+
+        router_dependencies = {}
+        for router in routers:
+            name = 'gateway-%s' % router.get('id')
+            tasks[name] = (partial(self.neutron.remove_gateway_router, router.get('id')), set(fip_tasks))
+            router_dependencies[router.get('id')] = {name}
+
+        network_dependencies = defaultdict(set)
+        sec_group_dependencies = defaultdict(set)
+        for port in ports:
+            owner = port.get('device_owner') or ''
+            if owner in ROUTER_INTERFACE_OWNERS and port.get('device_id') in router_dependencies:
+                name = 'interface-%s' % port.get('id')
+                tasks[name] = (partial(self.neutron.remove_interface_router, port.get('device_id'),
+                                       {'port_id': port.get('id')}), set(fip_tasks))
+                router_dependencies[port.get('device_id')].add(name)
+            elif owner in PORTS_REMOVED_WITH_OWNER:
+                continue
+            else:
+                name = 'port-%s' % port.get('id')
+                tasks[name] = (partial(self.neutron.delete_port, port.get('id')), set(fip_tasks))
+                for sec_group_id in port.get('security_groups') or []:
+                    sec_group_dependencies[sec_group_id].add(name)
+            network_dependencies[port.get('network_id')].add(name)
+
+        for router_id, dependencies in router_dependencies.items():
+            tasks['router-%s' % router_id] = (partial(self.neutron.delete_router, router_id), dependencies)
+        for network in networks:
+            tasks['network-%s' % network.get('id')] = (partial(self.neutron.delete_network, network.get('id')),
+                                                       network_dependencies[network.get('id')])
+        for sec_group in sec_groups:
+            tasks['security-group-%s' % sec_group.get('id')] = (
+                partial(self.neutron.delete_security_group, sec_group.get('id')),
+                sec_group_dependencies[sec_group.get('id')])
+
+        network_tasks = set(tasks.keys())
+        tasks['user'] = (partial(self.delete_user, username), network_tasks)
+        tasks['project'] = (partial(self.delete_project, project_id), network_tasks | {'user'})
+        return tasks
+
+
+def run_task_graph(tasks, max_workers=5):
+    """
+    Run every task in parallel as soon as the tasks it depends on are finished. A failing task is logged and does not
+    stop the tasks depending on it, so that as much as possible is executed.
+
+    :param tasks: dict of task name -> (function, set of the names of the tasks that must be finished before)
+    :param max_workers: maximum number of tasks running at the same time
+    :return: the names of the tasks that failed
+     :rtype: list
+    """
+    pending = {name: (function, dependencies & set(tasks.keys())) for name, (function, dependencies) in
+               tasks.items()}
+    finished = set()
+    failed = []
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in [n for n, (f, dependencies) in pending.items() if dependencies <= finished]:
+                function, dependencies = pending.pop(name)
+                running[executor.submit(function)] = name
+            if not running:
+                raise OpenstackClientError("Cyclic dependencies between the tasks %s" % list(pending.keys()))
+            done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                finished.add(name)
+                if future.exception() is not None:
+                    logger.error("Task %s failed: %s" % (name, future.exception()))
+                    failed.append(name)
+    return failed
+
 
 
 
@@ -536,53 +889,72 @@ def create_os_project(username, password, tenant_name, testbed_name=None):
     openstack_credentials = get_openstack_credentials()
     os_tenants = {}
     if not testbed_name:
+        timeout = get_config_float('system', 'testbed-timeout', 300)
+        executor = ThreadPoolExecutor(max_workers=max(len(openstack_credentials), 1))
+        futures = []
         for name, testbed in openstack_credentials.items():
+            logger.info("Creating project on testbed: %s" % name)
+            futures.append((name, executor.submit(_timed_create_single_project, tenant_name, testbed, name, username,
+                                                  password)))
+        deadline = time.time() + timeout
+        for name, future in futures:
             try:
-                logger.info("Creating project on testbed: %s" % name)
-                os_tenant_id, vim_instance = _create_single_project(tenant_name, testbed, name, username, password)
+                os_tenant_id, vim_instance = future.result(timeout=max(deadline - time.time(), 0))
                 logger.info("Created project %s on testbed: %s" % (os_tenant_id, name))
                 os_tenants[name] = {'tenant_id': os_tenant_id, 'vim_instance': vim_instance}
+            except TimeoutError:
+                logger.error("Not able to create project in testbed %s within %s seconds" % (name, timeout))
             except:
                 logger.error("Not able to create project in testbed %s" % name)
                 traceback.print_exc()
-                continue
+        # the threads of the testbeds that timed out are not waited for
+        executor.shutdown(wait=False)
     else:
-        os_tenant_id, vim_instance = _create_single_project(tenant_name,
-                                                            openstack_credentials[testbed_name],
-                                                            testbed_name)
+        os_tenant_id, vim_instance = _timed_create_single_project(tenant_name,
+                                                                  openstack_credentials[testbed_name],
+                                                                  testbed_name, username, password)
         os_tenants[testbed_name] = {'tenant_id': os_tenant_id, 'vim_instance': vim_instance}
     return os_tenants
 
 
+def _timed_create_single_project(tenant_name, testbed, testbed_name, username, password):
+    start = time.time()
+    try:
+        return _create_single_project(tenant_name, testbed, testbed_name, username, password)
+    finally:
+        provisioning_durations[testbed_name] = time.time() - start
+        logger.info("Project creation on testbed %s took %.2f seconds" % (testbed_name,
+                                                                         provisioning_durations[testbed_name]))
+
+
 def _create_single_project(tenant_name, testbed, testbed_name, username, password):
     os_client = OSClient(testbed_name, testbed)
     logger.info("Created OSClient for testbed %s" % testbed_name)
-    admin_user = os_client.get_user()
+    directory = get_testbed_directory(testbed_name)
+    admin_user = directory.get(os_client, 'admin_user')
 
     logger.debug("Got User %s" % admin_user)
-    admin_role = os_client.get_role('admin')
-    try:
-        user_role = os_client.get_role('_member_')
-    except:
-        user_role = os_client.get_role('member')
+    admin_role = directory.get(os_client, 'admin_role')
+    user_role = directory.get(os_client, 'member_role')
+    admin_os_client = os_client
 
     logger.debug("Got Role %s" % admin_role)
-    for tenant in os_client.list_tenants():
-        if tenant.name == tenant_name:
-            logger.warn("Tenant with name or id %s exists already! I assume a double registration i will not do "
-                        "anything :)" % tenant_name)
-            logger.warn("returning tenant id %s" % tenant.id)
-
-            exp_user = os_client.get_user(username)
-            if not exp_user:
-                exp_user = os_client.create_user(username, password)
-                os_client.add_user_role(user=exp_user, role=user_role, tenant=tenant.id)
-                os_client.add_user_role(user=admin_user, role=admin_role, tenant=tenant.id)
-            if os_client.api_version == 2:
-                vim_instance = os_client.get_vim_instance(tenant_name=tenant_name, username=username, password=password)
-            else:
-                vim_instance = os_client.get_vim_instance(tenant_name=tenant.id, username=username, password=password)
-            return tenant.id, vim_instance
+    tenant = os_client.get_tenant(tenant_name)
+    if tenant:
+        logger.warn("Tenant with name or id %s exists already! I assume a double registration i will not do "
+                    "anything :)" % tenant_name)
+        logger.warn("returning tenant id %s" % tenant.id)
+
+        exp_user = os_client.get_user(username)
+        if not exp_user:
+            exp_user = os_client.create_user(username, password)
+            os_client.add_user_role(user=exp_user, role=user_role, tenant=tenant.id)
+            os_client.add_user_role(user=admin_user, role=admin_role, tenant=tenant.id)
+        if os_client.api_version == 2:
+            vim_instance = os_client.get_vim_instance(tenant_name=tenant_name, username=username, password=password)
+        else:
+            vim_instance = os_client.get_vim_instance(tenant_name=tenant.id, username=username, password=password)
+        return tenant.id, vim_instance
 
     tenant = os_client.create_tenant(tenant_name=tenant_name, description='softfire tenant for user %s' % tenant_name)
     logger.debug("Created tenant %s" % tenant)
@@ -596,7 +968,7 @@ def _create_single_project(tenant_name, testbed, testbed_name, username, passwor
     os_client = OSClient(testbed_name, testbed, project_id=os_tenant_id, tenant_name=tenant_name)
 
     try:
-        ext_net = os_client.get_ext_net(testbed.get('ext_net_name'))
+        ext_net = directory.get(admin_os_client, 'ext_net')
 
         if ext_net is None:
             logger.error(
@@ -632,19 +1004,29 @@ def get_username_hash(username):
 
 def delete_tenant_and_user(username, testbed_tenants):
     openstack_credentials = get_openstack_credentials()
-    for testbed_id, project_id in testbed_tenants.items():
-        for testbed_name, credentials in openstack_credentials.items():
-            if get_testbed_name_from_id(testbed_id) == testbed_name:
-                os_client = OSClient(testbed_name, credentials)
-                os_client.delete_security_groups(project_id)
-                os_client.release_floating_ips(project_id)
-                os_client.remove_gateway_routers(project_id)
-                os_client.remove_interface_routers(project_id)
-                os_client.delete_ports(project_id)
-                os_client.delete_routers(project_id)
-                os_client.delete_networks(project_id)
-                os_client.delete_user(username)
-                os_client.delete_project(project_id)
+    with ThreadPoolExecutor(max_workers=max(len(testbed_tenants), 1)) as executor:
+        futures = []
+        for testbed_id, project_id in testbed_tenants.items():
+            for testbed_name, credentials in openstack_credentials.items():
+                if get_testbed_name_from_id(testbed_id) == testbed_name:
+                    futures.append((testbed_name, executor.submit(_delete_single_tenant, username, project_id,
+                                                                  credentials, testbed_name)))
+        for testbed_name, future in futures:
+            try:
+                future.result()
+            except:
+                logger.error("Not able to remove project of user %s from testbed %s" % (username, testbed_name))
+                traceback.print_exc()
+
+
+def _delete_single_tenant(username, project_id, testbed, testbed_name):
+    start = time.time()
+    os_client = OSClient(testbed_name, testbed)
+    failed = run_task_graph(os_client.get_teardown_tasks(project_id, username),
+                            max_workers=get_config_int('system', 'teardown-threads', 5))
+    if failed:
+        logger.warning("Not able to remove %s from testbed %s" % (failed, testbed_name))
+    logger.info("Removed project %s from testbed %s in %.2f seconds" % (project_id, testbed_name, time.time() - start))
 
 
 if __name__ == '__main__':
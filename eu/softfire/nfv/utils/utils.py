@@ -1,15 +1,97 @@
+import configparser
+import hashlib
 import json
 import logging
 import logging.config
 import os
+import threading
 
-from sdk.softfire.utils import get_config, TESTBED_MAPPING
+from sdk.softfire.utils import TESTBED_MAPPING
 
 from eu.softfire.nfv.utils.static_config import CONFIG_FILE_PATH
 
+# {config_file_path: ConfigParser}
+_configs = {}
+_config_lock = threading.RLock()
+_logging_configured = False
+
+# {file_path: ((mtime, inode, size), sha256)}
+_file_hashes = {}
+
+
+def read_config_file(config_file_path=CONFIG_FILE_PATH):
+    """
+    Return the ConfigParser holding the configuration. The file is parsed only once and the returned object is shared
+    by all the modules, so it must not be modified. Use reload_config to parse the file again.
+
+    :param config_file_path: the path of the configuration file
+    :return: the ConfigParser
+     :rtype: configparser.ConfigParser
+    """
+    config = _configs.get(config_file_path)
+    if config is None:
+        with _config_lock:
+            config = _configs.get(config_file_path)
+            if config is None:
+                config = _read_config(config_file_path)
+                _configs[config_file_path] = config
+    return config
+
+
+def _read_config(config_file_path):
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(config_file_path):
+        logging.error("Config file not found, please create %s" % config_file_path)
+    return config
+
+
+def get_config_value(section, key, default=None, config_file_path=CONFIG_FILE_PATH):
+    """
+    Return a value of the configuration, raising an error if it is missing and no default is passed. The value is
+    looked up at every call, so that it follows reload_config; the typed getters below behave the same.
+    """
+    if default is None:
+        return read_config_file(config_file_path).get(section, key)
+    return read_config_file(config_file_path).get(section, key, fallback=default)
+
+
+def get_config_int(section, key, default, config_file_path=CONFIG_FILE_PATH):
+    """Return a value of the configuration as int."""
+    return read_config_file(config_file_path).getint(section, key, fallback=default)
+
+
+def get_config_float(section, key, default, config_file_path=CONFIG_FILE_PATH):
+    """Return a value of the configuration as float."""
+    return read_config_file(config_file_path).getfloat(section, key, fallback=default)
+
+
+def get_config_bool(section, key, default, config_file_path=CONFIG_FILE_PATH):
+    """Return a value of the configuration as bool, accepting true/false, yes/no, on/off and 1/0."""
+    return read_config_file(config_file_path).getboolean(section, key, fallback=default)
+
+
+def reload_config():
+    """
+    Parse again all the configuration files read so far and the logging configuration.
+    """
+    global _logging_configured
+    with _config_lock:
+        for config_file_path in list(_configs.keys()):
+            _configs[config_file_path] = _read_config(config_file_path)
+        _logging_configured = False
+    _configure_logging()
+
+
+def _configure_logging():
+    global _logging_configured
+    with _config_lock:
+        if not _logging_configured:
+            logging.config.fileConfig(CONFIG_FILE_PATH, disable_existing_loggers=False)
+            _logging_configured = True
+
 
 def get_logger(name):
-    logging.config.fileConfig(CONFIG_FILE_PATH, disable_existing_loggers=False)
+    _configure_logging()
     if name.startswith("eu.softfire.nfv"):
         return logging.getLogger(name)
     return logging.getLogger("eu.softfire.nfv.%s" % name)
@@ -18,13 +100,112 @@ def get_logger(name):
 logger = get_logger(__name__)
 
 
+class NsdCatalogue(object):
+    def __init__(self, file_path):
+        """
+        The NSDs available for everyone, read from the available-nsds file. The file is parsed again only when its
+        modification time, inode or size changes.
+
+        :param file_path: the path of the available-nsds json file
+        """
+        self.file_path = file_path
+        self._file_stat = None
+        self._nsds = {}
+        self._lower_case_ids = {}
+        self._vnf_types = {}
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        stat = os.stat(self.file_path)
+        file_stat = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        if file_stat == self._file_stat:
+            return
+        with self._lock:
+            if file_stat == self._file_stat:
+                return
+            with open(self.file_path, 'r') as f:
+                nsds = json.loads(f.read())
+            logger.debug("Loaded %d available NSDs from %s" % (len(nsds), self.file_path))
+            self._lower_case_ids = {resource_id.lower(): resource_id for resource_id in nsds.keys()}
+            self._vnf_types = {resource_id: frozenset(nsd.get('vnf_types') or []) for resource_id, nsd in
+                               nsds.items()}
+            self._nsds = nsds
+            self._file_stat = file_stat
+
+    def as_dict(self):
+        self._reload_if_changed()
+        return self._nsds
+
+    def resolve(self, resource_id):
+        """
+        Return the resource id as written in the available-nsds file, ignoring the case if there is no exact match.
+
+        :param resource_id: the resource id
+        :return: the canonical resource id or None if the NSD is not available
+        """
+        self._reload_if_changed()
+        if resource_id in self._nsds:
+            return resource_id
+        if resource_id:
+            return self._lower_case_ids.get(resource_id.lower())
+
+    def get(self, resource_id):
+        """
+        Return the NSD with this resource id, ignoring the case if there is no exact match.
+
+        :param resource_id: the resource id
+        :return: the NSD as dict or None
+        """
+        resource_id = self.resolve(resource_id)
+        return self._nsds.get(resource_id)
+
+    def vnf_types(self, resource_id):
+        resource_id = self.resolve(resource_id)
+        return self._vnf_types.get(resource_id, frozenset())
+
+
+_nsd_catalogue = None
+
+
+def get_nsd_catalogue():
+    """
+    Return the catalogue of the available NSDs, created again when available-nsds-file-path changes.
+    """
+    global _nsd_catalogue
+    file_path = get_config_value('system', 'available-nsds-file-path')
+    with _config_lock:
+        if _nsd_catalogue is None or _nsd_catalogue.file_path != file_path:
+            _nsd_catalogue = NsdCatalogue(file_path)
+        return _nsd_catalogue
+
+
 def get_available_nsds():
-    with open(get_config('system', 'available-nsds-file-path', CONFIG_FILE_PATH), 'r') as f:
-        return json.loads(f.read())
+    return get_nsd_catalogue().as_dict()
+
+
+def get_file_sha256(file_path):
+    """
+    Return the SHA-256 hex digest of the file content, computed again only if the file changed.
+
+    :param file_path: the path of the file
+    :return: the hex digest
+     :rtype: str
+    """
+    stat = os.stat(file_path)
+    file_stat = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+    cached = _file_hashes.get(file_path)
+    if cached and cached[0] == file_stat:
+        return cached[1]
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    _file_hashes[file_path] = (file_stat, sha256.hexdigest())
+    return sha256.hexdigest()
 
 
 def get_openstack_credentials():
-    openstack_credential_file_path = get_config('system', 'openstack-credentials-file', CONFIG_FILE_PATH)
+    openstack_credential_file_path = get_config_value('system', 'openstack-credentials-file')
     # logger.debug("Openstack cred file is: %s" % openstack_credential_file_path)
     if os.path.exists(openstack_credential_file_path):
         with open(openstack_credential_file_path, "r") as f:
@@ -2,12 +2,12 @@ import unittest
 
 from org.openbaton.cli.agents.agents import OpenBatonAgentFactory
 
-from eu.softfire.nfv.utils import get_config
+from eu.softfire.nfv.utils.utils import read_config_file
 
 
 class MyTestCase(unittest.TestCase):
     def test_openbaton(self):
-        config = get_config()
+        config = read_config_file()
         agent = OpenBatonAgentFactory(nfvo_ip=config.get("nfvo", "ip"),
                                       nfvo_port=config.get("nfvo", "port"),
                                       https=config.getboolean("nfvo", "https"),
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from eu.softfire.nfv.utils import csar_utils
+from eu.softfire.nfv.utils.csar_utils import inspect_csar, validate_testbeds
+from eu.softfire.nfv.utils.exceptions import NfvResourceValidationError
+
+TOSCA_META = """TOSCA-Meta-File-Version: 1.0
+CSAR-Version: 1.1
+Created-By: softfire
+Entry-Definitions: Definitions/iperf.yaml
+"""
+
+DEFINITIONS = """tosca_definitions_version: tosca_simple_profile_for_nfv_1_0
+metadata:
+  ID: iperf-NS
+topology_template:
+  node_templates:
+    iperf-server:
+      type: openbaton.type.VNF
+    iperf-client:
+      type: openbaton.type.VNF
+    VDU1:
+      type: tosca.nodes.nfv.VDU
+    VDU2:
+      type: tosca.nodes.nfv.VDU
+    CP1:
+      type: tosca.nodes.nfv.CP
+"""
+
+
+class InspectCsarTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.csar')
+        os.close(fd)
+        csar_utils._csar_metadata.clear()
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def _write(self, members):
+        with zipfile.ZipFile(self.file_path, 'w') as csar:
+            for name, content in members.items():
+                csar.writestr(name, content)
+
+    def test_inspect(self):
+        self._write({'TOSCA-Metadata/TOSCA.meta': TOSCA_META, 'Definitions/iperf.yaml': DEFINITIONS,
+                     'Scripts/install.sh': '#!/bin/bash'})
+        metadata = inspect_csar(self.file_path)
+        self.assertEqual('iperf-NS', metadata.get('nsd_name'))
+        self.assertEqual({'VDU1', 'VDU2'}, metadata.get('vdu_names'))
+        self.assertEqual({'iperf-server', 'iperf-client'}, set(metadata.get('vnfs').keys()))
+
+    def test_metadata_cached_by_hash(self):
+        self._write({'TOSCA-Metadata/TOSCA.meta': TOSCA_META, 'Definitions/iperf.yaml': DEFINITIONS})
+        metadata = inspect_csar(self.file_path)
+        with mock.patch.object(csar_utils, '_parse_csar') as parse:
+            self.assertIs(metadata, inspect_csar(self.file_path))
+            parse.assert_not_called()
+
+    def test_invalid_csars(self):
+        invalid = [
+            {'Definitions/iperf.yaml': DEFINITIONS},
+            {'TOSCA-Metadata/TOSCA.meta': TOSCA_META},
+            {'TOSCA-Metadata/TOSCA.meta': TOSCA_META, 'Definitions/iperf.yaml': 'topology_template: ['},
+            {'TOSCA-Metadata/TOSCA.meta': TOSCA_META, 'Definitions/iperf.yaml': 'metadata: {}'},
+        ]
+        for i, members in enumerate(invalid):
+            self._write(members)
+            # the file hash is memoized by modification time
+            os.utime(self.file_path, ns=(0, i))
+            with self.assertRaises(NfvResourceValidationError):
+                inspect_csar(self.file_path)
+
+    def test_not_a_zip(self):
+        with open(self.file_path, 'w') as f:
+            f.write('not a zip')
+        with self.assertRaises(NfvResourceValidationError):
+            inspect_csar(self.file_path)
+
+    def test_validate_testbeds(self):
+        metadata = {'vdu_names': {'VDU1', 'VDU2'}}
+        validate_testbeds(metadata, {'VDU1': 'fokus', 'VDU2': 'ericsson'})
+        validate_testbeds(metadata, {'ANY': 'fokus'})
+        validate_testbeds(metadata, None)
+        with self.assertRaises(NfvResourceValidationError):
+            validate_testbeds(metadata, {'VDU3': 'fokus'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,403 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.request
+from unittest import mock
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from eu.softfire.nfv.core import NfvManager as nfv_manager_module
+from eu.softfire.nfv.core.EventListener import EventListener
+from eu.softfire.nfv.core.NfvManager import NfvManager, ReleaseReaper, RELEASE_DELETING, RELEASE_DONE, \
+    RELEASE_FAILED
+from eu.softfire.nfv.core.StatusScheduler import StatusScheduler
+from eu.softfire.nfv.db.entities import Nsr
+from eu.softfire.nfv.utils import utils
+from eu.softfire.nfv.utils.static_config import CONFIG_FILE_PATH
+from eu.softfire.nfv.utils.utils import NsdCatalogue
+
+
+def get_manager():
+    manager = NfvManager.__new__(NfvManager)
+    manager.config_file_path = CONFIG_FILE_PATH
+    manager.last_update_stats = {'duration': 0.0, 'polled': 0, 'sent': 0}
+    manager.status_scheduler = StatusScheduler(interval=10, max_interval=600)
+    manager.release_reaper = ReleaseReaper()
+    manager._sent_digests = {}
+    manager._sent_digests_lock = threading.RLock()
+    return manager
+
+
+def get_nsr(_id, username, status):
+    nsr = Nsr()
+    nsr.id = _id
+    nsr.username = username
+    nsr.status = status
+    return nsr
+
+
+def get_updated_nsr(nsr):
+    return {'id': nsr.id, 'status': 'ACTIVE'}
+
+
+class UpdateStatusTestCase(unittest.TestCase):
+    def setUp(self):
+        self.nsrs = [
+            get_nsr('1', 'alice', 'NULL'),
+            get_nsr('3', 'bob', 'INITIALIZED'),
+            get_nsr('4', 'bob', 'ERROR'),
+        ]
+        # NSR 4 was removed from the NFVO, bob has an untracked NSR 5
+        self.listed = {
+            'alice': [get_updated_nsr(self.nsrs[0])],
+            'bob': [get_updated_nsr(self.nsrs[1]), {'id': '5', 'status': 'ACTIVE'}],
+        }
+        self.ob_clients = {}
+
+    def get_ob_client(self, username):
+        ob_client = self.ob_clients.get(username)
+        if ob_client is None:
+            ob_client = mock.Mock(project_id=username)
+            ob_client.list_nsrs.return_value = self.listed.get(username)
+            self.ob_clients[username] = ob_client
+        return ob_client
+
+    def _update_status(self, manager, update_threads=1):
+        values = {'update-threads': update_threads}
+        with mock.patch.object(nfv_manager_module, 'get_nsrs_to_check', return_value=self.nsrs), \
+                mock.patch.object(nfv_manager_module, 'get_ob_client', side_effect=self.get_ob_client), \
+                mock.patch.object(nfv_manager_module, 'remove_nsr_to_check') as remove_nsr_to_check, \
+                mock.patch.object(nfv_manager_module, 'upsert_all') as upsert_all, \
+                mock.patch.object(NfvManager, 'get_config_int',
+                                  side_effect=lambda section, key, default: values.get(key, default)):
+            result = manager._update_status()
+        return result, remove_nsr_to_check, upsert_all
+
+    def _assert_synced(self, update_threads):
+        manager = get_manager()
+        result, remove_nsr_to_check, upsert_all = self._update_status(manager, update_threads)
+        self.assertEqual({'alice': [json.dumps(get_updated_nsr(self.nsrs[0]))],
+                          'bob': [json.dumps(get_updated_nsr(self.nsrs[1]))]}, result)
+        # one request per project, the disappeared NSR is dropped and the cycle is saved with one batch
+        for ob_client in self.ob_clients.values():
+            ob_client.list_nsrs.assert_called_once_with()
+            ob_client.get_nsr.assert_not_called()
+        remove_nsr_to_check.assert_called_once_with('4')
+        upsert_all.assert_called_once()
+        self.assertEqual(['1', '3'], sorted(values.get('id') for values in upsert_all.call_args[0][1]))
+        self.assertEqual(3, manager.last_update_stats.get('polled'))
+        self.assertEqual(2, manager.last_update_stats.get('projects'))
+
+    def test_sequential(self):
+        self._assert_synced(1)
+
+    def test_concurrent(self):
+        self._assert_synced(4)
+
+    def test_scheduled_projects_are_skipped(self):
+        manager = get_manager()
+        manager.status_scheduler.checked('3', 'INITIALIZED')
+        manager.status_scheduler.checked('4', 'ERROR')
+        self._update_status(manager)
+        self.assertEqual(['alice'], list(self.ob_clients.keys()))
+        self.assertEqual(1, manager.last_update_stats.get('polled'))
+
+    def test_unchanged_nsrs_are_not_sent(self):
+        manager = get_manager()
+        self._update_status(manager)
+        manager.status_scheduler = StatusScheduler(interval=10, max_interval=600)
+        result, _, _ = self._update_status(manager)
+        self.assertEqual({}, result)
+        self.assertEqual(3, manager.last_update_stats.get('polled'))
+        self.assertEqual(0, manager.last_update_stats.get('sent'))
+
+    def test_listing_error_keeps_the_nsrs(self):
+        manager = get_manager()
+        self.get_ob_client('bob').list_nsrs.side_effect = Exception('NFVO not reachable')
+        result, remove_nsr_to_check, _ = self._update_status(manager)
+        self.assertEqual(['alice'], list(result.keys()))
+        remove_nsr_to_check.assert_not_called()
+
+    def test_requests_per_user_are_capped(self):
+        limits = {'update-threads-per-user': 1}
+        with mock.patch.object(nfv_manager_module, 'get_config_int',
+                               side_effect=lambda section, key, default: limits.get(key, default)):
+            slot = nfv_manager_module._user_slot('alice')
+            self.assertIs(slot, nfv_manager_module._user_slot('alice'))
+            self.assertIsNot(slot, nfv_manager_module._user_slot('bob'))
+            with slot:
+                self.assertFalse(slot.acquire(blocking=False))
+            # a reload changing the limit applies to the next requests
+            limits['update-threads-per-user'] = 2
+            self.assertIsNot(slot, nfv_manager_module._user_slot('alice'))
+
+    def _reconcile(self, manager, send_error=None):
+        nsrs = self.nsrs + [get_nsr('5', 'bob', 'ACTIVE')]
+        with mock.patch.object(nfv_manager_module, 'iter_nsrs', return_value=nsrs), \
+                mock.patch.object(nfv_manager_module, 'get_ob_client', side_effect=self.get_ob_client), \
+                mock.patch.object(nfv_manager_module, 'remove_nsr_to_check') as remove_nsr_to_check, \
+                mock.patch.object(nfv_manager_module, 'upsert_all') as upsert_all, \
+                mock.patch.object(NfvManager, 'get_config_int',
+                                  side_effect=lambda section, key, default: default), \
+                mock.patch.object(NfvManager, '_send_status', side_effect=send_error) as send_status, \
+                mock.patch.object(ReleaseReaper, 'resume') as resume:
+            manager.reconcile()
+        resume.assert_called_once_with()
+        return remove_nsr_to_check, upsert_all, send_status
+
+    def test_reconcile(self):
+        manager = get_manager()
+        manager._mark_sent({'id': '4', 'status': 'ERROR'})
+        remove_nsr_to_check, upsert_all, send_status = self._reconcile(manager)
+        remove_nsr_to_check.assert_called_once_with('4')
+        self.assertNotIn('4', manager._sent_digests)
+        self.assertEqual(['1', '3', '5'], sorted(values.get('id') for values in upsert_all.call_args[0][1]))
+        sent = send_status.call_args[0][0]
+        self.assertEqual(['1'], [json.loads(res).get('id') for res in sent.get('alice')])
+        self.assertEqual(['3', '5'], sorted(json.loads(res).get('id') for res in sent.get('bob')))
+
+    def test_reconcile_send_error(self):
+        manager = get_manager()
+        with self.assertRaises(Exception):
+            self._reconcile(manager, send_error=Exception('experiment manager not reachable'))
+        # the changes are sent again by the next update
+        self.assertEqual({}, manager._sent_digests)
+
+
+class EventTestCase(unittest.TestCase):
+    def test_listener_delivers_events(self):
+        received = []
+        delivered = threading.Event()
+
+        def handler(event):
+            received.append(event)
+            delivered.set()
+
+        listener = EventListener(handler, 0)
+        listener.start()
+        try:
+            event = {'action': 'INSTANTIATE_FINISH', 'payload': {'id': '1'}}
+            request = urllib.request.Request('http://localhost:%s/events' % listener.port,
+                                             data=json.dumps(event).encode('utf-8'),
+                                             headers={'content-type': 'application/json'})
+            self.assertEqual(200, urllib.request.urlopen(request).status)
+            self.assertTrue(delivered.wait(5))
+        finally:
+            listener.stop()
+        self.assertEqual([event], received)
+
+    def _handle_event(self, event, fetched, sent=None, manager=None):
+        manager = manager or get_manager()
+        if sent:
+            manager._mark_sent(sent)
+        tracked = get_nsr('1', 'alice', 'NULL')
+        # an NSR not fetched anymore was removed by _check_nsr
+        with mock.patch.object(nfv_manager_module, 'find_nsr', side_effect=[tracked, tracked if fetched else None]), \
+                mock.patch.object(nfv_manager_module, '_check_nsr',
+                                  return_value=json.dumps(fetched) if fetched else None) as check_nsr, \
+                mock.patch.object(NfvManager, '_send_status') as send_status:
+            manager.handle_event(event)
+        return check_nsr, send_status
+
+    def test_payload_is_not_trusted(self):
+        forged = {'id': '1', 'status': 'ERROR', 'vnfr': []}
+        fetched = {'id': '1', 'status': 'ACTIVE', 'vnfr': []}
+        check_nsr, send_status = self._handle_event({'action': 'ERROR', 'payload': forged}, fetched)
+        self.assertEqual('1', check_nsr.call_args[0][0].id)
+        send_status.assert_called_once_with({'alice': [json.dumps(fetched)]})
+
+    def test_unchanged_status_is_not_sent(self):
+        nsr = {'id': '1', 'status': 'ACTIVE', 'vnfr': []}
+        check_nsr, send_status = self._handle_event({'action': 'HEAL', 'payload': nsr}, nsr, sent=nsr)
+        check_nsr.assert_called_once()
+        send_status.assert_not_called()
+
+    def test_vanished_nsr_is_not_sent(self):
+        manager = get_manager()
+        check_nsr, send_status = self._handle_event({'action': 'HEAL', 'payload': {'id': '1'}}, None,
+                                                    sent={'id': '1', 'status': 'ACTIVE'}, manager=manager)
+        send_status.assert_not_called()
+        self.assertNotIn('1', manager._sent_digests)
+
+    def test_releasing_nsr_is_ignored(self):
+        manager = get_manager()
+        with mock.patch.object(manager.release_reaper, 'is_releasing', return_value=True):
+            check_nsr, send_status = self._handle_event({'action': 'HEAL', 'payload': {'id': '1'}},
+                                                        {'id': '1', 'status': 'ACTIVE'}, manager=manager)
+        check_nsr.assert_not_called()
+        send_status.assert_not_called()
+
+    def test_removed_nsr_is_not_tracked_again(self):
+        ob_client = mock.Mock(project_id='project')
+        ob_client.get_nsr.return_value = json.dumps({'id': '1', 'status': 'ACTIVE', 'vnfr': []})
+        with mock.patch.object(nfv_manager_module, 'get_ob_client', return_value=ob_client), \
+                mock.patch.object(nfv_manager_module, 'upsert') as upsert:
+            nfv_manager_module._update_nsr(get_nsr('1', 'alice', 'NULL'))
+        self.assertFalse(upsert.call_args[1].get('insert'))
+
+    def test_changed_ips_are_sent(self):
+        sent = {'id': '1', 'status': 'ACTIVE', 'vnfr': [
+            {'name': 'iperf', 'status': 'ACTIVE', 'vdu': [
+                {'vnfc_instance': [{'hostname': 'iperf-1', 'ips': [{'netName': 'private', 'ip': '10.0.0.2'}]}]}]}]}
+        nsr = json.loads(json.dumps(sent))
+        nsr['vnfr'][0]['vdu'][0]['vnfc_instance'][0]['ips'][0]['ip'] = '10.0.0.3'
+        check_nsr, send_status = self._handle_event({'action': 'HEAL', 'payload': {'id': '1'}}, nsr, sent=sent)
+        send_status.assert_called_once_with({'alice': [json.dumps(nsr)]})
+
+
+class ListResourcesTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        with open(self.file_path, 'w') as f:
+            f.write(json.dumps({'Open5GCore': {'cardinality': 1, 'description': 'Open5GCore NS'}}))
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_unknown_nsds_are_skipped(self):
+        ob_client = mock.Mock()
+        ob_client.list_nsds.return_value = [{'name': 'Open5GCore'}, {'name': 'foreign-nsd', 'description': 'foreign'}]
+        with mock.patch.object(nfv_manager_module, 'get_nsd_catalogue', return_value=NsdCatalogue(self.file_path)), \
+                mock.patch.object(nfv_manager_module, 'get_ob_client', return_value=ob_client), \
+                mock.patch.object(NfvManager, 'refresh_resources', return_value=[]) as refresh_resources:
+            result = get_manager().list_resources(user_info=mock.Mock())
+        self.assertEqual(['Open5GCore', 'Open5GCore'], [resource.resource_id for resource in result])
+        self.assertEqual('Open5GCore NS', result[0].description)
+        self.assertEqual(1, result[0].cardinality)
+        refresh_resources.assert_called_once()
+
+
+class ReleaseResourcesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manager = get_manager()
+        self.ob_client = mock.Mock()
+        self.ob_client.get_nsd.return_value = json.dumps({'vnfd': []})
+        patchers = [mock.patch.object(nfv_manager_module, 'get_ob_client', return_value=self.ob_client),
+                    mock.patch.object(nfv_manager_module, 'try_delete_nsr'),
+                    mock.patch.object(NfvManager, 'events_enabled', return_value=True),
+                    mock.patch.object(self.manager.release_reaper, 'submit')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _release(self, tracked):
+        with mock.patch.object(nfv_manager_module, 'iter_nsrs', return_value=iter(tracked)):
+            self.manager.release_resources(mock.Mock(), json.dumps({'id': '1', 'descriptor_reference': 'nsd'}))
+
+    def test_last_nsr_unsubscribes(self):
+        self._release([])
+        self.ob_client.unsubscribe_events.assert_called_once_with()
+
+    def test_other_nsr_keeps_subscriptions(self):
+        self._release([get_nsr('2', 'alice', 'ACTIVE')])
+        self.ob_client.unsubscribe_events.assert_not_called()
+
+    def test_delete_user_unsubscribes(self):
+        with mock.patch.object(nfv_manager_module, 'remove_all'), \
+                mock.patch.object(nfv_manager_module, 'invalidate_ob_client'), \
+                mock.patch.object(nfv_manager_module.os_utils, 'delete_tenant_and_user'):
+            self.manager.delete_user(mock.Mock())
+        self.ob_client.unsubscribe_events.assert_called_once_with()
+
+
+class ApplyConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.ini')
+        os.close(fd)
+        self._write('30')
+
+    def tearDown(self):
+        utils._configs.pop(self.file_path, None)
+        os.remove(self.file_path)
+
+    def _write(self, delay):
+        with open(self.file_path, 'w') as f:
+            f.write('[system]\nupdate-delay = %s\nrelease-timeout = %s\n' % (delay, delay))
+
+    def test_reload(self):
+        manager = get_manager()
+        manager.config_file_path = self.file_path
+        manager.apply_config()
+        self.assertEqual(30, manager.status_scheduler.interval)
+        self.assertEqual(600, manager.status_scheduler.max_interval)
+        self._write('40')
+        utils.reload_config()
+        manager.apply_config()
+        self.assertEqual(40, manager.status_scheduler.interval)
+        self.assertEqual(40, manager.release_reaper.timeout)
+
+
+class ReleaseReaperTestCase(unittest.TestCase):
+    def setUp(self):
+        # the release jobs stored in the database
+        self.release_jobs = {}
+        patchers = [mock.patch.object(nfv_manager_module, 'upsert', side_effect=self._upsert),
+                    mock.patch.object(nfv_manager_module, 'find', side_effect=self._find),
+                    mock.patch.object(nfv_manager_module, 'delete', side_effect=self._delete)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.untracked = []
+        self.reaper = ReleaseReaper(timeout=100, initial_delay=0, on_untracked=self.untracked.append)
+        self.reaper.submit('alice', 'nsr', 'nsd')
+        self.ob_client = mock.Mock()
+
+    def _upsert(self, _clazz, values):
+        self.release_jobs[values.get('id')] = _clazz(**values)
+
+    def _find(self, _clazz, _id=None):
+        if _id is None:
+            return list(self.release_jobs.values())
+        if _id not in self.release_jobs:
+            raise NoResultFound()
+        return self.release_jobs.get(_id)
+
+    def _delete(self, entity):
+        self.release_jobs.pop(entity.id)
+
+    def _check(self):
+        with mock.patch.object(nfv_manager_module, 'get_ob_client', return_value=self.ob_client), \
+                mock.patch.object(nfv_manager_module, 'remove_nsr_to_check') as remove_nsr_to_check:
+            for job in self.reaper._due_jobs():
+                self.reaper._check(job)
+        return remove_nsr_to_check
+
+    def test_nsr_still_existing(self):
+        remove_nsr_to_check = self._check()
+        job = self.reaper.get_job('nsr')
+        self.assertEqual(RELEASE_DELETING, job.get('status'))
+        self.assertTrue(self.reaper.is_releasing('nsr'))
+        self.assertGreater(job.get('next_check'), job.get('submitted'))
+        remove_nsr_to_check.assert_not_called()
+
+    def test_nsr_removed(self):
+        self.ob_client.get_nsr.side_effect = nfv_manager_module.NfvoException('not found')
+        remove_nsr_to_check = self._check()
+        self.assertEqual(RELEASE_DONE, self.reaper.get_job('nsr').get('status'))
+        self.ob_client.delete_nsd.assert_called_once_with('nsd')
+        remove_nsr_to_check.assert_called_once_with('nsr')
+        self.assertEqual(['nsr'], self.untracked)
+        self.assertEqual({}, self.release_jobs)
+
+    def test_resume_after_restart(self):
+        submitted = self.reaper.get_job('nsr').get('submitted')
+        reaper = ReleaseReaper(timeout=100, initial_delay=0)
+        reaper.resume()
+        job = reaper.get_job('nsr')
+        self.assertEqual(RELEASE_DELETING, job.get('status'))
+        self.assertEqual('nsd', job.get('nsd_id'))
+        self.assertEqual(submitted, job.get('submitted'))
+
+    def test_timeout(self):
+        self.reaper.timeout = -1
+        remove_nsr_to_check = self._check()
+        self.assertEqual(RELEASE_FAILED, self.reaper.get_job('nsr').get('status'))
+        self.ob_client.delete_nsd.assert_not_called()
+        remove_nsr_to_check.assert_called_once_with('nsr')
+
+
+if __name__ == '__main__':
+    unittest.main()
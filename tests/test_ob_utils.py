@@ -0,0 +1,219 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from eu.softfire.nfv.utils import ob_utils
+from eu.softfire.nfv.utils.exceptions import NfvResourceValidationError
+
+
+def config_int(values):
+    return lambda section, key, default: values.get(key, default)
+
+
+class FakeOBClient(object):
+    def __init__(self, project_name=None):
+        self.project_id = None if project_name == 'missing' else 'id-%s' % project_name
+
+
+@mock.patch.object(ob_utils, 'OBClient', FakeOBClient)
+class OBClientCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        ob_utils._ob_clients.clear()
+
+    def test_client_is_reused(self):
+        self.assertIs(ob_utils.get_ob_client('alice'), ob_utils.get_ob_client('alice'))
+        self.assertIsNot(ob_utils.get_ob_client('alice'), ob_utils.get_ob_client('bob'))
+
+    def test_invalidate(self):
+        client = ob_utils.get_ob_client('alice')
+        ob_utils.invalidate_ob_client('alice')
+        self.assertIsNot(client, ob_utils.get_ob_client('alice'))
+
+    def test_missing_project_not_cached(self):
+        ob_utils.get_ob_client('missing')
+        self.assertNotIn('missing', ob_utils._ob_clients)
+
+    def test_eviction(self):
+        with mock.patch.object(ob_utils, 'get_config_int', side_effect=config_int({'client-cache-size': 2})):
+            for name in ['a', 'b', 'c']:
+                ob_utils.get_ob_client(name)
+        self.assertEqual(['b', 'c'], list(ob_utils._ob_clients.keys()))
+
+    def test_expiration(self):
+        client = ob_utils.get_ob_client('alice')
+        with mock.patch.object(ob_utils, 'get_config_int', side_effect=config_int({'client-cache-ttl': -1})):
+            self.assertIsNot(client, ob_utils.get_ob_client('alice'))
+
+
+class NfvoIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.projects = [{'id': '1', 'name': 'alice'}, {'id': '2', 'name': 'bob'}]
+        self.listings = 0
+
+        def list_projects():
+            self.listings += 1
+            return list(self.projects)
+
+        self.index = ob_utils.NfvoIndex(list_projects)
+
+    def test_filled_once(self):
+        self.assertEqual('1', self.index.get('alice').get('id'))
+        self.assertEqual('2', self.index.get('bob').get('id'))
+        self.assertEqual(1, self.listings)
+
+    def test_put_and_remove(self):
+        self.index.get('alice')
+        self.index.put({'id': '3', 'name': 'carol'})
+        self.assertEqual('3', self.index.get('carol').get('id'))
+        self.index.remove_by_id('1')
+        with mock.patch.object(ob_utils, 'get_config_int', return_value=3600):
+            self.assertIsNone(self.index.get('alice'))
+        self.assertEqual(1, self.listings)
+
+    def test_refresh_on_miss(self):
+        self.index.get('alice')
+        self.projects.append({'id': '3', 'name': 'carol'})
+        with mock.patch.object(ob_utils, 'get_config_int', return_value=-1):
+            self.assertEqual('3', self.index.get('carol').get('id'))
+        self.assertEqual(2, self.listings)
+
+
+class CreateVimInstancesTestCase(unittest.TestCase):
+    def test_only_missing_are_uploaded(self):
+        ob_client = ob_utils.OBClient.__new__(ob_utils.OBClient)
+        ob_client.vim_index = ob_utils.NfvoIndex(lambda: [{'id': '1', 'name': 'vim-instance-fokus'}])
+        uploaded = []
+
+        def upload(vim_instance):
+            if vim_instance.get('name') == 'vim-instance-ads':
+                raise ob_utils.NfvoException('error')
+            uploaded.append(vim_instance.get('name'))
+            return {'id': '2', 'name': vim_instance.get('name')}
+
+        ob_client._upload_vim_instance = upload
+        result = ob_client.create_vim_instances({
+            'fokus': {'name': 'vim-instance-fokus'},
+            'surrey': {'name': 'vim-instance-surrey'},
+            'ads': {'name': 'vim-instance-ads'},
+        })
+        self.assertEqual(['vim-instance-surrey'], uploaded)
+        self.assertEqual('1', result.get('fokus').get('id'))
+        self.assertEqual('2', result.get('surrey').get('id'))
+        self.assertIsNone(result.get('ads'))
+
+
+def get_client_without_init():
+    ob_client = ob_utils.OBClient.__new__(ob_utils.OBClient)
+    ob_client.project_id = 'project'
+    ob_client.agent_factory = mock.Mock()
+    return ob_client
+
+
+class UploadPackagesTestCase(unittest.TestCase):
+    @mock.patch.object(ob_utils, 'get_config_bool', return_value=False)
+    def test_conflicts_list_nsds_once(self, get_config_bool):
+        ob_client = get_client_without_init()
+
+        def create(package_path):
+            if package_path.endswith('existing.tar'):
+                raise ob_utils.NfvoException('conflict')
+            return {'id': 'new-%s' % package_path}
+
+        ob_client.agent_factory.get_vnf_package_agent.return_value.create.side_effect = create
+        ob_client.list_nsds = mock.Mock(return_value=[{'vnfd': [{'name': 'existing', 'id': 'old'}]}])
+        vnfds = ob_client.upload_packages([('a.tar', 'a'), ('existing.tar', 'existing'), ('2/existing.tar', 'existing'),
+                                           ('b.tar', 'b')])
+        self.assertEqual(['new-a.tar', 'old', 'old', 'new-b.tar'], [vnfd.get('id') for vnfd in vnfds])
+        ob_client.list_nsds.assert_called_once_with()
+
+
+@mock.patch.object(ob_utils, 'get_config_bool', return_value=True)
+class PackageDedupTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.package_path = tempfile.mkstemp(suffix='.tar')
+        os.write(fd, b'package')
+        os.close(fd)
+        self.ob_client = get_client_without_init()
+        self.ob_client.agent_factory.get_vnf_package_agent.return_value.create.return_value = {'id': 'new'}
+        self.saved = {}
+
+    def tearDown(self):
+        os.remove(self.package_path)
+
+    def _find(self, _clazz, _id=None):
+        if _id not in self.saved:
+            raise NoResultFound()
+        return self.saved.get(_id)
+
+    def _upsert(self, _clazz, values):
+        self.saved[values.get('id')] = _clazz(**values)
+
+    def _delete(self, entity):
+        self.saved.pop(entity.id)
+
+    def _upload(self):
+        with mock.patch.object(ob_utils, 'find', side_effect=self._find), \
+                mock.patch.object(ob_utils, 'upsert', side_effect=self._upsert), \
+                mock.patch.object(ob_utils, 'delete', side_effect=self._delete):
+            return self.ob_client.upload_package(self.package_path, 'package')
+
+    def test_package_uploaded_once(self, get_config_bool):
+        self.assertEqual('new', self._upload().get('id'))
+        self.assertEqual('new', self._upload().get('id'))
+        self.ob_client.agent_factory.get_vnf_package_agent.return_value.create.assert_called_once_with(
+            self.package_path)
+
+    def test_vnfd_removed(self, get_config_bool):
+        self._upload()
+        self.ob_client.agent_factory.get_vnf_descriptor_agent.return_value.find.side_effect = ob_utils.NfvoException(
+            'not found')
+        self._upload()
+        self.assertEqual(2, self.ob_client.agent_factory.get_vnf_package_agent.return_value.create.call_count)
+
+
+class PlanVduVimInstancesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ob_client = get_client_without_init()
+        self.ob_client.vim_index = ob_utils.NfvoIndex(
+            lambda: [{'name': 'vim-instance-fokus'}, {'name': 'vim-instance-ericsson'}])
+
+    def test_plan(self):
+        self.assertEqual({'VDU1': ['vim-instance-fokus'], 'VDU2': ['vim-instance-fokus']},
+                         self.ob_client.plan_vdu_vim_instances({'VDU1', 'VDU2'}, {'ANY': 'fokus'}))
+        self.assertEqual({'VDU1': ['vim-instance-ericsson']},
+                         self.ob_client.plan_vdu_vim_instances({'VDU1', 'VDU2'}, {'VDU1': 'ericsson'}))
+        self.ob_client.agent_factory.assert_not_called()
+
+    def test_invalid_mapping(self):
+        for testbeds in [{'VDU3': 'fokus'}, {'VDU1': 'surrey'}, {}]:
+            with self.assertRaises(NfvResourceValidationError):
+                self.ob_client.plan_vdu_vim_instances({'VDU1', 'VDU2'}, testbeds)
+
+
+class EventSubscriptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ob_client = get_client_without_init()
+        self.ob_client.events_subscribed = False
+        self.event_agent = self.ob_client.agent_factory.get_event_agent.return_value
+        self.event_agent.find.return_value = '[]'
+
+    def test_subscribe_once(self):
+        self.ob_client.subscribe_events('http://nfv-manager/events', ['INSTANTIATE_FINISH', 'ERROR'])
+        self.ob_client.subscribe_events('http://nfv-manager/events', ['INSTANTIATE_FINISH', 'ERROR'])
+        self.assertEqual(2, self.event_agent.create.call_count)
+
+    def test_unsubscribe(self):
+        self.ob_client.events_subscribed = True
+        self.event_agent.find.return_value = json.dumps([{'id': '1', 'name': 'nfv-manager-error'},
+                                                         {'id': '2', 'name': 'other'}])
+        self.ob_client.unsubscribe_events()
+        self.event_agent.delete.assert_called_once_with('1')
+        self.assertFalse(self.ob_client.events_subscribed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
 import logging
+import time
 import unittest
+from unittest import mock
 
+from keystoneauth1.exceptions.http import NotFound
+
+from eu.softfire.nfv.utils import os_utils
 from eu.softfire.nfv.utils import utils
 
 TESTBED_UNDER_TEST = 'fokus'
@@ -32,6 +37,239 @@ class MyTestCase(unittest.TestCase):
         logging.debug(credentials)
 
 
+class CreateOsProjectTestCase(unittest.TestCase):
+    def _create_single_project(self, tenant_name, testbed, testbed_name, username, password):
+        if testbed.get('error'):
+            raise Exception('testbed not reachable')
+        time.sleep(testbed.get('delay', 0))
+        return 'id-%s' % testbed_name, {'name': 'vim-instance-%s' % testbed_name}
+
+    def _create_os_project(self, credentials, timeout=300):
+        with mock.patch.object(os_utils, 'get_openstack_credentials', return_value=credentials), \
+                mock.patch.object(os_utils, '_create_single_project', side_effect=self._create_single_project), \
+                mock.patch.object(os_utils, 'get_config_float', return_value=timeout):
+            return os_utils.create_os_project('user', 'pwd', 'user')
+
+    def test_all_testbeds(self):
+        os_tenants = self._create_os_project({'fokus': {}, 'surrey': {}})
+        self.assertEqual(['fokus', 'surrey'], list(os_tenants.keys()))
+        self.assertEqual({'tenant_id': 'id-fokus', 'vim_instance': {'name': 'vim-instance-fokus'}},
+                         os_tenants.get('fokus'))
+        self.assertIn('surrey', os_utils.provisioning_durations)
+
+    def test_testbed_errors_are_isolated(self):
+        os_tenants = self._create_os_project({'fokus': {'error': True}, 'surrey': {}, 'ads': {'delay': 0.5}},
+                                             timeout=0.2)
+        self.assertEqual(['surrey'], list(os_tenants.keys()))
+        # let the thread of the testbed that timed out finish
+        time.sleep(0.5)
+
+
+class TeardownTestCase(unittest.TestCase):
+    def test_run_task_graph_order(self):
+        executed = []
+        tasks = {
+            'router': (lambda: executed.append('router'), {'interface', 'gateway'}),
+            'interface': (lambda: executed.append('interface'), {'floatingip'}),
+            'gateway': (lambda: executed.append('gateway'), {'floatingip'}),
+            'floatingip': (lambda: executed.append('floatingip'), set()),
+        }
+        self.assertEqual([], os_utils.run_task_graph(tasks))
+        self.assertEqual('floatingip', executed[0])
+        self.assertEqual('router', executed[-1])
+
+    def test_run_task_graph_failure(self):
+        executed = []
+
+        def fail():
+            raise Exception('conflict')
+
+        tasks = {
+            'port': (fail, set()),
+            'network': (lambda: executed.append('network'), {'port'}),
+        }
+        self.assertEqual(['port'], os_utils.run_task_graph(tasks))
+        self.assertEqual(['network'], executed)
+
+    def test_teardown_tasks(self):
+        os_client = os_utils.OSClient.__new__(os_utils.OSClient)
+        os_client.neutron = mock.Mock()
+        os_client.list_floatingips = lambda p: {'floatingips': [{'id': 'f1'}]}
+        os_client.list_routers = lambda p: {'routers': [{'id': 'r1'}]}
+        os_client.list_ports = lambda p: {'ports': [
+            {'id': 'p1', 'device_owner': 'network:router_interface', 'device_id': 'r1', 'network_id': 'n1'},
+            {'id': 'p2', 'device_owner': 'compute:nova', 'network_id': 'n1', 'security_groups': ['s1']},
+            {'id': 'p3', 'device_owner': 'network:dhcp', 'network_id': 'n1'},
+        ]}
+        os_client.list_networks = lambda p: {'networks': [{'id': 'n1'}]}
+        os_client.list_sec_group = lambda p: [{'id': 's1'}]
+        tasks = os_client.get_teardown_tasks('project', 'user')
+
+        self.assertEqual({'gateway-r1', 'interface-p1'}, tasks.get('router-r1')[1])
+        self.assertEqual({'interface-p1', 'port-p2'}, tasks.get('network-n1')[1])
+        self.assertEqual({'port-p2'}, tasks.get('security-group-s1')[1])
+        self.assertEqual({'floatingip-f1'}, tasks.get('port-p2')[1])
+        self.assertNotIn('port-p3', tasks)
+        self.assertIn('network-n1', tasks.get('project')[1])
+
+
+class OsSessionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        os_utils._os_sessions.clear()
+
+    def get_client(self, project_id=None):
+        os_client = os_utils.OSClient.__new__(os_utils.OSClient)
+        os_client.api_version = 3
+        os_client.auth_url = 'http://keystone:5000/v3'
+        os_client.username = 'admin'
+        os_client.password = 'pwd'
+        os_client.project_id = project_id
+        os_client.admin_project_id = 'admin-project'
+        os_client.project_domain_name = 'Default'
+        os_client.user_domain_id = 'Default'
+        return os_client
+
+    def test_sessions_are_shared(self):
+        admin_session = self.get_client()._get_session()
+        self.assertIs(admin_session, self.get_client()._get_session())
+        project_session = self.get_client('project')._get_session()
+        self.assertIsNot(admin_session, project_session)
+        self.assertIs(project_session, self.get_client()._get_session('project'))
+        os_utils.invalidate_os_sessions('project')
+        self.assertIsNot(project_session, self.get_client('project')._get_session())
+        self.assertIs(admin_session, self.get_client()._get_session())
+
+    def test_v2_sessions_removed_with_the_tenant(self):
+        os_client = os_utils.OSClient('fokus', LazyOSClientTestCase.testbed)
+        tenant_session = os_utils.OSClient('fokus', LazyOSClientTestCase.testbed, tenant_name='alice')._get_session()
+        tenant = mock.Mock(spec=['id', 'name'], id='alice-id')
+        tenant.name = 'alice'
+        os_client.keystone = mock.Mock()
+        os_client.keystone.tenants.get.return_value = tenant
+        os_client.delete_project('alice-id')
+        os_client.keystone.tenants.delete.assert_called_once_with('alice-id')
+        self.assertIsNot(tenant_session,
+                         os_utils.OSClient('fokus', LazyOSClientTestCase.testbed, tenant_name='alice')._get_session())
+
+
+class LazyOSClientTestCase(unittest.TestCase):
+    testbed = {'api_version': 2, 'username': 'admin', 'password': 'pwd', 'auth_url': 'http://keystone:5000/v2.0/',
+               'admin_tenant_name': 'admin'}
+
+    def test_clients_created_on_first_use(self):
+        with mock.patch.object(os_utils.OSClient, '_get_tenant_id_from_name', return_value='id') as get_tenant_id:
+            os_client = os_utils.OSClient('fokus', self.testbed, tenant_name='user')
+            self.assertIsNone(os_client._keystone)
+            get_tenant_id.assert_not_called()
+            nova = os_client.nova
+            self.assertIs(nova, os_client.nova)
+            get_tenant_id.assert_called_once_with('user')
+            self.assertIsNone(os_client._neutron)
+            self.assertIsNone(os_client._glance)
+        self.assertEqual('id', os_client.os_tenant_id)
+
+    def test_admin_client_has_no_service_clients(self):
+        os_client = os_utils.OSClient('fokus', self.testbed)
+        self.assertIsNone(os_client.nova)
+        self.assertIsNone(os_client.neutron)
+
+    def test_admin_scope_on_create_tenant(self):
+        os_client = os_utils.OSClient('fokus', self.testbed)
+        with mock.patch.object(os_utils, 'get_os_session') as get_os_session, \
+                mock.patch.object(os_utils.keystoneclient.v2_0.client, 'Client'), \
+                mock.patch.object(os_utils, 'Neutron'):
+            os_client.create_tenant('newuser', 'softfire tenant for user newuser')
+            os_client.get_admin_neutron()
+        self.assertEqual(['admin', 'admin'], [call[0][0][-1] for call in get_os_session.call_args_list])
+        self.assertEqual('newuser', os_client.tenant_name)
+
+
+class FilteredLookupTestCase(unittest.TestCase):
+    def get_client(self, api_version):
+        os_client = os_utils.OSClient.__new__(os_utils.OSClient)
+        os_client.api_version = api_version
+        os_client.auth_url = 'http://keystone-%s' % api_version
+        os_client.username = 'admin'
+        os_client.keystone = mock.Mock()
+        os_client.neutron = mock.Mock()
+        return os_client
+
+    def test_v3_lookups_are_filtered(self):
+        os_client = self.get_client(3)
+        os_client.keystone.users.list.return_value = ['admin-user']
+        os_client.keystone.roles.list.return_value = []
+        self.assertEqual('admin-user', os_client.get_user())
+        os_client.keystone.users.list.assert_called_once_with(name='admin')
+        self.assertIsNone(os_client.get_role('member'))
+        os_client.keystone.roles.list.assert_called_once_with(name='member')
+        os_client.neutron.list_networks.return_value = {'networks': [{'id': 'ext'}]}
+        self.assertEqual({'id': 'ext'}, os_client.get_ext_net('softfire-network'))
+        os_client.neutron.list_networks.assert_called_once_with(name='softfire-network', **{'router:external': True})
+
+    def test_v2_lookups_use_the_index(self):
+        os_utils._os_indexes.clear()
+        role = mock.Mock(spec=['name'])
+        role.name = 'admin'
+        os_client = self.get_client(2)
+        os_client.keystone.roles.list.return_value = [role]
+        self.assertIs(role, os_client.get_role('admin'))
+        self.assertIs(role, self.get_client(2).get_role('admin'))
+        os_client.keystone.roles.list.assert_called_once_with()
+
+    def test_v2_removed_tenant_is_dropped(self):
+        os_utils._os_indexes.clear()
+        tenant = mock.Mock(spec=['id', 'name'], id='1')
+        tenant.name = 'alice'
+        os_client = self.get_client(2)
+        os_client.keystone.tenants.list.return_value = [tenant]
+        os_client.keystone.tenants.get.return_value = tenant
+        self.assertIs(tenant, os_client.get_tenant('alice'))
+        os_client.keystone.tenants.get.side_effect = NotFound()
+        self.assertIsNone(os_client.get_tenant('alice'))
+        os_client.keystone.tenants.get.assert_called_with('1')
+        self.assertNotIn('alice', os_utils.get_os_index(os_client.auth_url, 'tenants')._entries)
+
+
+class OSIndexTestCase(unittest.TestCase):
+    def test_refresh_on_miss(self):
+        entities = [mock.Mock(username='alice')]
+        list_function = mock.Mock(side_effect=lambda: entities)
+        index = os_utils.OSIndex(ttl=3600, miss_refresh_interval=0)
+        self.assertIs(entities[0], index.get('alice', list_function))
+        self.assertEqual(1, list_function.call_count)
+        entities.append(mock.Mock(username='bob'))
+        self.assertIs(entities[1], index.get('bob', list_function))
+        self.assertEqual(2, list_function.call_count)
+        index.miss_refresh_interval = 3600
+        self.assertIsNone(index.get('carol', list_function))
+        self.assertEqual(2, list_function.call_count)
+
+
+class TestbedDirectoryTestCase(unittest.TestCase):
+    def get_client(self, roles):
+        os_client = mock.Mock(testbed_name='fokus', testbed={'ext_net_name': 'softfire-network'})
+        os_client.get_role.side_effect = lambda name: roles.get(name)
+        os_client.get_admin_neutron.return_value.list_networks.return_value = {'networks': [{'id': 'ext'}]}
+        return os_client
+
+    def test_loaded_once(self):
+        directory = os_utils.TestbedDirectory(ttl=3600, miss_refresh_interval=3600)
+        os_client = self.get_client({'admin': 'admin-role', 'member': 'member-role'})
+        self.assertEqual('member-role', directory.get(os_client, 'member_role'))
+        self.assertEqual('admin-role', directory.get(os_client, 'admin_role'))
+        self.assertEqual({'id': 'ext'}, directory.get(os_client, 'ext_net'))
+        os_client.get_user.assert_called_once_with()
+        os_client.get_admin_neutron.assert_called_once_with()
+
+    def test_reload_on_miss(self):
+        directory = os_utils.TestbedDirectory(ttl=3600, miss_refresh_interval=0)
+        roles = {'admin': 'admin-role'}
+        os_client = self.get_client(roles)
+        self.assertIsNone(directory.get(os_client, 'member_role'))
+        roles['_member_'] = 'member-role'
+        self.assertEqual('member-role', directory.get(os_client, 'member_role'))
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
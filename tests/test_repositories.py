@@ -0,0 +1,145 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from eu.softfire.nfv.db.entities import Base, Nsr
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from eu.softfire.nfv.db import repositories
+from eu.softfire.nfv.db.repositories import find, upsert, upsert_all, delete, iter_nsrs
+
+
+class RepositoryTestCase(unittest.TestCase):
+    def setUp(self):
+        # every test uses its own database instead of the configured one
+        fd, self.file_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = create_engine('sqlite:///%s' % self.file_path, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(self.engine)
+        session = scoped_session(sessionmaker(bind=self.engine, expire_on_commit=False))
+        patchers = [mock.patch.object(repositories, 'engine', self.engine),
+                    mock.patch.object(repositories, '_session', session)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        repositories._session.remove()
+        self.engine.dispose()
+        os.remove(self.file_path)
+
+
+class UpsertTestCase(RepositoryTestCase):
+
+    def test_insert_and_update(self):
+        upsert(Nsr, {'id': 'test-upsert-1', 'username': 'alice', 'status': 'NULL', 'vnfc_hostnames': {}})
+        upsert(Nsr, {'id': 'test-upsert-1', 'username': 'alice', 'status': 'ACTIVE', 'vnfc_hostnames': {'vnf': ['h1']}})
+        nsr = find(Nsr, 'test-upsert-1')
+        self.assertEqual('ACTIVE', nsr.status)
+        self.assertEqual({'vnf': ['h1']}, nsr.vnfc_hostnames)
+
+    def test_batch_without_insert(self):
+        upsert(Nsr, {'id': 'test-upsert-1', 'username': 'alice', 'status': 'NULL', 'vnfc_hostnames': {}})
+        upsert_all(Nsr, [{'id': 'test-upsert-1', 'username': 'alice', 'status': 'ERROR', 'vnfc_hostnames': {}},
+                         {'id': 'test-upsert-2', 'username': 'bob', 'status': 'ERROR', 'vnfc_hostnames': {}}],
+                   insert=False)
+        self.assertEqual('ERROR', find(Nsr, 'test-upsert-1').status)
+        self.assertEqual([], [nsr for nsr in find(Nsr) if nsr.id == 'test-upsert-2'])
+
+    def test_concurrent_insert_is_retried(self):
+        apply_values = repositories._apply_values
+        calls = []
+
+        def insert_concurrently(se, _clazz, values, insert):
+            calls.append(values.get('id'))
+            if len(calls) == 1:
+                # the row was inserted by another thread between the lookup and the commit
+                raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed'))
+            apply_values(se, _clazz, values, insert)
+
+        with mock.patch.object(repositories, '_apply_values', side_effect=insert_concurrently):
+            upsert(Nsr, {'id': 'test-upsert-1', 'username': 'alice', 'status': 'NULL', 'vnfc_hostnames': {}})
+        self.assertEqual(2, len(calls))
+        self.assertEqual('alice', find(Nsr, 'test-upsert-1').username)
+
+
+class SessionTestCase(RepositoryTestCase):
+    def test_entities_usable_across_threads(self):
+        upsert(Nsr, {'id': 'test-session-1', 'username': 'alice', 'status': 'NULL', 'vnfc_hostnames': {}})
+        found = []
+        thread = threading.Thread(target=lambda: found.append(find(Nsr, 'test-session-1')))
+        thread.start()
+        thread.join()
+        # the session of the other thread is closed, the entity is detached but loaded
+        self.assertEqual('alice', found[0].username)
+        delete(found[0])
+        self.assertEqual([], [nsr for nsr in find(Nsr) if nsr.id == 'test-session-1'])
+
+
+class IterNsrsTestCase(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        upsert_all(Nsr, [
+            {'id': 'test-iter-1', 'username': 'test-alice', 'status': 'ACTIVE', 'last_checked': 10},
+            {'id': 'test-iter-2', 'username': 'test-alice', 'status': 'NULL', 'last_checked': 20},
+            {'id': 'test-iter-3', 'username': 'test-bob', 'status': 'ERROR', 'last_checked': None},
+        ])
+
+    def _ids(self, **kwargs):
+        return [nsr.id for nsr in iter_nsrs(batch_size=1, **kwargs) if nsr.id.startswith('test-iter-')]
+
+    def test_filters(self):
+        self.assertEqual(['test-iter-2', 'test-iter-3'], self._ids(exclude_statuses=['ACTIVE']))
+        self.assertEqual(['test-iter-1'], self._ids(statuses=['ACTIVE']))
+        self.assertEqual(['test-iter-1', 'test-iter-2'], self._ids(username='test-alice'))
+        self.assertEqual(['test-iter-1', 'test-iter-3'], self._ids(checked_before=15))
+
+
+class MigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        connection = sqlite3.connect(self.file_path)
+        connection.execute('CREATE TABLE ns_records (id VARCHAR(250) NOT NULL, username VARCHAR(250) NOT NULL, '
+                           'status VARCHAR(250) NOT NULL, vnf_log_url BLOB, PRIMARY KEY (id))')
+        connection.execute('INSERT INTO ns_records VALUES (?, ?, ?, ?)',
+                           ('1', 'alice', 'ACTIVE', pickle.dumps({'iperf': 'host1;host2;'})))
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_migrate_pickled_hostnames(self):
+        engine = create_engine('sqlite:///%s' % self.file_path)
+        statements = []
+        event.listen(engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement.upper()))
+        repositories._migrate_ns_records(engine)
+        # dropping a column is not supported by the SQLite versions older than 3.35
+        self.assertFalse([statement for statement in statements if 'DROP' in statement])
+        columns = [column.get('name') for column in inspect(engine).get_columns('ns_records')]
+        self.assertIn('last_checked', columns)
+        indexes = [index.get('name') for index in inspect(engine).get_indexes('ns_records')]
+        self.assertEqual({'ix_ns_records_username', 'ix_ns_records_status', 'ix_ns_records_last_checked'},
+                         set(indexes))
+        with engine.begin() as connection:
+            row = connection.execute(Nsr.__table__.select()).one()
+            self.assertIsNone(connection.execute(text('SELECT vnf_log_url FROM ns_records')).scalar())
+            connection.execute(Nsr.__table__.insert().values(id='2', username='bob', status='ACTIVE'))
+        self.assertEqual({'iperf': ['host1', 'host2']}, row.vnfc_hostnames)
+        # the converted rows are not converted again
+        repositories._migrate_ns_records(engine)
+        with engine.connect() as connection:
+            self.assertEqual(2, len(connection.execute(Nsr.__table__.select()).all()))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from eu.softfire.nfv.core.StatusScheduler import StatusScheduler
+
+
+class StatusSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = StatusScheduler(interval=10, max_interval=100, factor=2, grace_checks=2)
+
+    def _check(self, status, now):
+        self.scheduler.checked('nsr', status, now=now)
+        return self.scheduler._schedule['nsr']['next_check'] - now
+
+    def test_unscheduled_nsr_is_not_due(self):
+        self.assertFalse(self.scheduler.is_scheduled('nsr'))
+        self.assertEqual(set(), self.scheduler.pop_due(0))
+
+    def test_backoff(self):
+        intervals = [self._check('ERROR', 0) for _ in range(7)]
+        self.assertEqual([10, 10, 20, 40, 80, 100, 100], intervals)
+
+    def test_status_change_resets_backoff(self):
+        for _ in range(5):
+            self._check('NULL', 0)
+        self.assertEqual(10, self._check('INITIALIZED', 0))
+
+    def test_pop_due(self):
+        self.scheduler.checked('nsr', 'NULL', now=0)
+        self.assertEqual(set(), self.scheduler.pop_due(5))
+        self.assertEqual({'nsr'}, self.scheduler.pop_due(10))
+        self.assertEqual(set(), self.scheduler.pop_due(10))
+
+    def test_reset(self):
+        self.scheduler.checked('nsr', 'NULL', now=0)
+        self.scheduler.reset('nsr')
+        self.assertFalse(self.scheduler.is_scheduled('nsr'))
+        self.assertEqual(set(), self.scheduler.pop_due(10))
+
+    def test_retain(self):
+        self.scheduler.checked('nsr', 'NULL', now=0)
+        self.scheduler.checked('other', 'NULL', now=0)
+        self.scheduler.retain({'other'})
+        self.assertFalse(self.scheduler.is_scheduled('nsr'))
+        self.assertTrue(self.scheduler.is_scheduled('other'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from eu.softfire.nfv.utils import utils
+from eu.softfire.nfv.utils.utils import NsdCatalogue, read_config_file, get_config_value, get_config_int, \
+    get_config_float, get_config_bool, reload_config
+
+
+class NsdCatalogueTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self._write({'Open5GCore': {'cardinality': 1, 'vnf_types': ['mme', 'sgw']}})
+        self.catalogue = NsdCatalogue(self.file_path)
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def _write(self, nsds):
+        with open(self.file_path, 'w') as f:
+            f.write(json.dumps(nsds))
+
+    def test_lookup(self):
+        self.assertEqual(1, self.catalogue.get('Open5GCore').get('cardinality'))
+        self.assertEqual(1, self.catalogue.get('open5gcore').get('cardinality'))
+        self.assertIsNone(self.catalogue.get('iperf'))
+        self.assertEqual({'mme', 'sgw'}, self.catalogue.vnf_types('Open5GCore'))
+        self.assertEqual({'mme', 'sgw'}, self.catalogue.vnf_types('OPEN5GCORE'))
+
+    def test_resolve(self):
+        self.assertEqual('Open5GCore', self.catalogue.resolve('Open5GCore'))
+        self.assertEqual('Open5GCore', self.catalogue.resolve('open5gcore'))
+        self.assertIsNone(self.catalogue.resolve('iperf'))
+        self.assertIsNone(self.catalogue.resolve(None))
+
+    def test_reload_on_change(self):
+        self.assertIsNone(self.catalogue.get('iperf'))
+        self._write({'iperf': {'cardinality': -1}, 'Open5GCore': {'cardinality': 1}})
+        os.utime(self.file_path, ns=(0, 1))
+        self.assertEqual(-1, self.catalogue.get('iperf').get('cardinality'))
+        self.assertEqual(frozenset(), self.catalogue.vnf_types('Open5GCore'))
+
+    def test_path_change(self):
+        self.addCleanup(setattr, utils, '_nsd_catalogue', utils._nsd_catalogue)
+        with mock.patch.object(utils, 'get_config_value', return_value=self.file_path):
+            catalogue = utils.get_nsd_catalogue()
+            self.assertIs(catalogue, utils.get_nsd_catalogue())
+        with mock.patch.object(utils, 'get_config_value', return_value='/tmp/other-nsds.json'):
+            self.assertEqual('/tmp/other-nsds.json', utils.get_nsd_catalogue().file_path)
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.ini')
+        os.close(fd)
+        self._write('10')
+
+    def tearDown(self):
+        utils._configs.pop(self.file_path, None)
+        os.remove(self.file_path)
+
+    def _write(self, delay):
+        with open(self.file_path, 'w') as f:
+            f.write('[system]\nupdate-delay = %s\n' % delay)
+
+    def test_parsed_once(self):
+        self.assertIs(read_config_file(self.file_path), read_config_file(self.file_path))
+        self.assertEqual(10, read_config_file(self.file_path).getint('system', 'update-delay'))
+        self.assertEqual('5', get_config_value('system', 'missing', '5', config_file_path=self.file_path))
+
+    def test_reload(self):
+        self.assertEqual('10', get_config_value('system', 'update-delay', config_file_path=self.file_path))
+        self._write('20')
+        self.assertEqual('10', get_config_value('system', 'update-delay', config_file_path=self.file_path))
+        reload_config()
+        self.assertEqual('20', get_config_value('system', 'update-delay', config_file_path=self.file_path))
+
+    def test_typed_values(self):
+        self.assertEqual(10, get_config_int('system', 'update-delay', 1, config_file_path=self.file_path))
+        self.assertEqual(10.0, get_config_float('system', 'update-delay', 1, config_file_path=self.file_path))
+        self.assertTrue(get_config_bool('system', 'missing', True, config_file_path=self.file_path))
+        self._write('20')
+        reload_config()
+        self.assertEqual(20, get_config_int('system', 'update-delay', 1, config_file_path=self.file_path))
+
+
+if __name__ == '__main__':
+    unittest.main()